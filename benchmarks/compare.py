@@ -0,0 +1,50 @@
+"""
+Compares two outputs of benchmarks/pipeline.py, e.g. of the main branch and
+of a change. Exits with 1 when a stage got slower by more than the threshold.
+
+    python benchmarks/compare.py main.json change.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def load(path: str) -> dict:
+    data = json.loads(Path(path).read_text())
+    return {
+        (result["stage"], result["payments"]): result["median"]
+        for result in data["results"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown regarded as a regression",
+    )
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    regressions = 0
+    for key in sorted(base.keys() & head.keys(), key=lambda key: (key[1], key[0])):
+        stage, payments = key
+        change = head[key] / base[key] - 1
+        regression = change > args.threshold
+        regressions += regression
+        print(
+            f"{stage:<22} {payments:>8} payments"
+            f" {base[key] * 1000:10.1f} ms -> {head[key] * 1000:10.1f} ms"
+            f" {change:+8.1%}{'  REGRESSION' if regression else ''}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Replays report traffic against a running server at increasing concurrency
+and reports throughput, latency percentiles and error rates for each level.
+
+    python benchmarks/nbp_server.py --latency 0.05 &
+    NBP_API_URL=http://localhost:8001 python manage.py runserver --noreload &
+    python benchmarks/load_test.py --url http://localhost:8000 --concurrency 1,8,32
+
+Traffic comes from the Postman collection (the default), JSON lines files of
+{"method": ..., "path": ..., "body": ...} requests and/or synthetic reports of
+a given size. GETs of /customer-report/<id>/ are pointed at reports created
+by the replayed POSTs.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.payloads import report_payload  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+customer_report_re = re.compile(r"^/customer-report/\d+/?$")
+
+
+def postman_requests(path: Path):
+    def walk(items):
+        for item in items:
+            if "item" in item:
+                yield from walk(item["item"])
+                continue
+            request = item["request"]
+            url = request["url"]
+            url = urlsplit(url if isinstance(url, str) else url["raw"])
+            body = request.get("body", {}).get("raw") or None
+            yield {
+                "name": item["name"],
+                "method": request["method"],
+                "path": url.path + (f"?{url.query}" if url.query else ""),
+                "body": body.encode() if body else None,
+            }
+
+    yield from walk(json.loads(path.read_text())["item"])
+
+
+def jsonl_requests(path: Path):
+    for number, line in enumerate(path.read_text().splitlines(), 1):
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if "method" not in entry or "path" not in entry:
+            raise SystemExit(f"{path}:{number}: a request needs a method and a path")
+        body = entry.get("body")
+        yield {
+            "name": entry.get("name", f"{path.name}:{number}"),
+            "method": entry["method"].upper(),
+            "path": entry["path"],
+            "body": json.dumps(body).encode() if body is not None else None,
+        }
+
+
+def synthetic_requests(payments: int):
+    body = json.dumps(report_payload(payments)).encode()
+    for path in ("/report/", "/customer-report/"):
+        yield {
+            "name": f"{path} {payments} payments",
+            "method": "POST",
+            "path": path,
+            "body": body,
+        }
+
+
+def percentile(ordered, fraction: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class LoadTest:
+    def __init__(self, base_url: str, traffic, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.traffic = traffic
+        self.timeout = timeout
+        self.customer_ids = []
+        self.local = threading.local()
+
+    def send(self, entry):
+        """Latency in seconds and the status code, None if the request failed"""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        path = entry["path"]
+        if customer_report_re.match(path) and self.customer_ids:
+            path = f"/customer-report/{random.choice(self.customer_ids)}/"
+
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                entry["method"],
+                self.base_url + path,
+                data=entry["body"],
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout,
+            )
+            response.content
+        except requests.RequestException:
+            return time.perf_counter() - start, None
+        latency = time.perf_counter() - start
+
+        if entry["method"] == "POST" and response.status_code == 201:
+            customer_id = response.json().get("customer_id")
+            if customer_id is not None:
+                self.customer_ids.append(customer_id)
+        return latency, response.status_code
+
+    def run(self, concurrency: int, total: int) -> dict:
+        entries = itertools.islice(itertools.cycle(self.traffic), total)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(self.send, entries))
+        elapsed = time.perf_counter() - start
+
+        statuses = Counter(str(status) for _, status in results)
+        errors = sum(1 for _, status in results if status is None or status >= 400)
+        latencies = sorted(latency for latency, _ in results)
+        return {
+            "concurrency": concurrency,
+            "requests": len(results),
+            "seconds": elapsed,
+            "throughput": len(results) / elapsed,
+            "error_rate": errors / len(results),
+            "statuses": dict(statuses),
+            "mean": statistics.fmean(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--postman",
+        default=str(ROOT / "straal.postman_collection.json"),
+        help="Postman collection to replay, pass an empty string to skip it",
+    )
+    parser.add_argument(
+        "--traffic", type=Path, action="append", default=[], help="JSON lines file"
+    )
+    parser.add_argument(
+        "--payments",
+        type=int,
+        action="append",
+        default=[],
+        help="Adds synthetic /report/ and /customer-report/ POSTs of that size",
+    )
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per concurrency level"
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    traffic = []
+    if args.postman:
+        traffic.extend(postman_requests(Path(args.postman)))
+    for path in args.traffic:
+        traffic.extend(jsonl_requests(path))
+    for payments in args.payments:
+        traffic.extend(synthetic_requests(payments))
+    if not traffic:
+        raise SystemExit("Nothing to replay")
+
+    load_test = LoadTest(args.url, traffic, args.timeout)
+    print(
+        f"{'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'p99 ms':>8} {'errors':>7}"
+    )
+    results = []
+    for concurrency in map(int, args.concurrency.split(",")):
+        result = load_test.run(concurrency, args.requests)
+        results.append(result)
+        print(
+            f"{concurrency:>11} {result['throughput']:8.1f}"
+            f" {result['p50'] * 1000:8.1f} {result['p95'] * 1000:8.1f}"
+            f" {result['p99'] * 1000:8.1f} {result['error_rate']:7.1%}"
+        )
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps({"url": args.url, "results": results}, indent=2) + "\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Local stand-in for the NBP exchange rates API, for load tests which should
+depend neither on api.nbp.pl nor on a monkeypatch.
+
+    python benchmarks/nbp_server.py --port 8001 --latency 0.05 --error-rate 0.01
+    NBP_API_URL=http://localhost:8001 python manage.py runserver
+
+Rates of table A are made up but stable, the same currency and day always
+get the same rate. Like the real API it publishes nothing on weekends (a
+range without a single business day is a 404) and refuses ranges longer
+than 93 days.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+rates_re = re.compile(
+    r"^/api/exchangerates/rates/a/(?P<code>[a-z]{3})/(?P<start>\d{4}-\d{2}-\d{2})"
+    r"(?:/(?P<end>\d{4}-\d{2}-\d{2}))?/?(?:\?.*)?$",
+    re.IGNORECASE,
+)
+MAX_RANGE_DAYS = 93
+BASE_RATES = {"EUR": 4.5, "USD": 3.8, "GBP": 5.2, "CHF": 4.1}
+
+
+def rate(code: str, date: datetime.date) -> float:
+    base = BASE_RATES.get(code, 1 + sum(map(ord, code)) % 7)
+    return round(base * (1 + 0.02 * ((date.toordinal() % 30) / 30 - 0.5)), 4)
+
+
+def business_days(start: datetime.date, end: datetime.date):
+    for offset in range((end - start).days + 1):
+        date = start + datetime.timedelta(days=offset)
+        if date.weekday() < 5:
+            yield date
+
+
+class NBPHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    quiet = True
+
+    def do_GET(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if random.random() < self.error_rate:
+            return self.respond(503, "Service Unavailable")
+
+        match = rates_re.match(self.path)
+        if match is None:
+            return self.respond(404, "404 NotFound")
+        try:
+            start = datetime.date.fromisoformat(match["start"])
+            end = datetime.date.fromisoformat(match["end"] or match["start"])
+        except ValueError:
+            return self.respond(400, "400 BadRequest - Błędny zakres dat")
+        if end < start or (end - start).days >= MAX_RANGE_DAYS:
+            return self.respond(
+                400, "400 BadRequest - Przekroczony limit 93 dni / Limit of 93 days"
+            )
+
+        code = match["code"].upper()
+        rates = [
+            {
+                "no": f"{date.timetuple().tm_yday:03}/A/NBP/{date.year}",
+                "effectiveDate": date.isoformat(),
+                "mid": rate(code, date),
+            }
+            for date in business_days(start, end)
+        ]
+        if not rates:
+            return self.respond(404, "404 NotFound - Not Found - Brak danych")
+        self.respond(
+            200,
+            json.dumps({"table": "A", "currency": code, "code": code, "rates": rates}),
+            "application/json",
+        )
+
+    def respond(self, status: int, body: str, content_type: str = "text/plain"):
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        try:
+            self.wfile.write(content)
+        except BrokenPipeError:
+            # The client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        if not self.quiet:
+            super().log_message(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds every response takes"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Up to that many seconds more"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of 503 responses"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    NBPHandler.latency = args.latency
+    NBPHandler.jitter = args.jitter
+    NBPHandler.error_rate = args.error_rate
+    NBPHandler.quiet = not args.verbose
+    server = ThreadingHTTPServer((args.host, args.port), NBPHandler)
+    print(f"Serving NBP on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
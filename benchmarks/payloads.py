@@ -0,0 +1,81 @@
+"""
+Synthetic request bodies of /report/ and /customer-report/. Payloads are
+reproducible, the same size and seed always give the same payments.
+"""
+
+import datetime
+
+import factory
+from factory import fuzzy
+from factory.random import randgen, reseed_random
+
+START = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+# Spread over a year, so that a report needs a few hundred exchange rates
+PERIOD_SECONDS = 365 * 24 * 60 * 60
+CURRENCIES = ("PLN", "EUR", "USD", "GBP")
+IBANS = (
+    "DE91100000000123456789",
+    "GB29NWBK60161331926819",
+    "PL61109010140000071219812874",
+    "FR1420041010050500013M02606",
+    "NL91ABNA0417164300",
+    "ES9121000418450200051332",
+)
+NAMES = ("John", "Anna", "Piotr", "Maria", "Jan")
+SURNAMES = ("Doe", "Kowalska", "Nowak", "Smith", "Wiśniewski")
+BANKS = ("mbank", "ing", "pko", "santander", "millennium")
+
+
+def created_at() -> str:
+    return (
+        START + datetime.timedelta(seconds=randgen.randrange(PERIOD_SECONDS))
+    ).isoformat()
+
+
+def card_number() -> str:
+    """A random 16 digit number passing Luhn's check"""
+    digits = [randgen.randrange(10) for _ in range(15)]
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2 == 0:
+            digit *= 2
+        total += digit - 9 if digit > 9 else digit
+    return "".join(map(str, digits)) + str(-total % 10)
+
+
+class PaymentFactory(factory.DictFactory):
+    created_at = factory.LazyFunction(created_at)
+    currency = fuzzy.FuzzyChoice(CURRENCIES)
+    amount = fuzzy.FuzzyInteger(1, 10**6)
+    description = factory.LazyFunction(lambda: f"REF{randgen.randrange(10**6):06}")
+
+
+class DirectPaymentFactory(PaymentFactory):
+    iban = fuzzy.FuzzyChoice(IBANS)
+
+
+class CardPaymentFactory(PaymentFactory):
+    cardholder_name = fuzzy.FuzzyChoice(NAMES)
+    cardholder_surname = fuzzy.FuzzyChoice(SURNAMES)
+    card_number = factory.LazyFunction(card_number)
+
+
+class PayByLinkFactory(PaymentFactory):
+    bank = fuzzy.FuzzyChoice(BANKS)
+
+
+FACTORIES = {
+    "dp": DirectPaymentFactory,
+    "card": CardPaymentFactory,
+    "pay_by_link": PayByLinkFactory,
+}
+
+
+def report_payload(payments: int, seed: int = 0) -> dict:
+    """Request body with that many payments of all types mixed"""
+    reseed_random(seed)
+    types = randgen.choices(list(FACTORIES), k=payments)
+    return {
+        payment_type: factory_class.build_batch(types.count(payment_type))
+        for payment_type, factory_class in FACTORIES.items()
+    }
@@ -0,0 +1,91 @@
+"""
+Compares DRF's JSON parser/renderer with the orjson based ones on a large
+/report/ payload, and the cost of compressing the rendered report.
+
+    python benchmarks/report_json.py --payments 20000
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "straal.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from benchmarks.payloads import report_payload  # noqa: E402
+from reports.encoding import BROTLI, GZIP, available, compress  # noqa: E402
+from reports.integration import rate_cache, rate_cache_key  # noqa: E402
+from reports.parsers import ORJSONParser  # noqa: E402
+from reports.renderers import ORJSONRenderer  # noqa: E402
+from reports.views import generate_report, rate_pairs, render_report  # noqa: E402
+
+
+def best_of(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def compare(name: str, baseline, candidate, repeat: int) -> None:
+    before, after = best_of(baseline, repeat), best_of(candidate, repeat)
+    print(
+        f"{name:<8} drf {before * 1000:9.1f} ms   orjson {after * 1000:9.1f} ms"
+        f"   x{before / after:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payments", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = JSONRenderer().render(report_payload(args.payments))
+    data = ORJSONParser().parse(io.BytesIO(body))
+    report, errors = generate_report(data)
+    assert not errors, errors
+    # No calls to NBP, every rate is already known
+    for currency, created_at in rate_pairs(report):
+        rate_cache.set(rate_cache_key(currency, created_at), 4.0)
+    rows = render_report(report)
+    assert ORJSONRenderer().render(rows) == JSONRenderer().render(rows)
+
+    print(f"{args.payments} payments, request {len(body)} bytes")
+    compare(
+        "parse",
+        lambda: JSONParser().parse(io.BytesIO(body)),
+        lambda: ORJSONParser().parse(io.BytesIO(body)),
+        args.repeat,
+    )
+    compare(
+        "render",
+        lambda: JSONRenderer().render(rows),
+        lambda: ORJSONRenderer().render(rows),
+        args.repeat,
+    )
+
+    content = ORJSONRenderer().render(rows)
+    print(f"response {len(content)} bytes")
+    for encoding in (GZIP, BROTLI):
+        if not available(encoding):
+            print(f"{encoding:<8} not installed")
+            continue
+        seconds = best_of(lambda: compress(content, encoding), args.repeat)
+        compressed = compress(content, encoding)
+        print(
+            f"{encoding:<8} {len(compressed)} bytes"
+            f" ({len(compressed) / len(content):.0%}) in {seconds * 1000:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
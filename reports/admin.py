@@ -2,4 +2,6 @@ from django.contrib import admin
 
 from . import models
 
-admin.site.register([models.Card, models.DirectPayment, models.PayByLink])
+admin.site.register(
+    [models.Card, models.DirectPayment, models.PayByLink, models.ExchangeRate]
+)
@@ -0,0 +1,157 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from reports.integration import aprefetch_exchange_rates
+from reports.metrics import timed
+from reports.pagination import ReportPagination, filter_by_date
+from reports.parsers import loads
+from reports.renderers import ORJSONRenderer
+from reports.streaming import in_chronological_order, render_rows, streaming_requested
+from reports.utils import query_flag
+from reports.views import (
+    CustomerReportView,
+    generate_report,
+    rate_pairs,
+    render_report,
+    save_report,
+)
+
+customer_report_view = CustomerReportView.as_view()
+# Rows of a streamed report rendered per trip to a worker thread
+STREAM_BATCH_SIZE = 1000
+
+
+def json_response(data, status=200) -> HttpResponse:
+    return HttpResponse(
+        ORJSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+def render_page(page):
+    return [payment.data for payment in page]
+
+
+async def arender_rows(report):
+    """
+    render_rows as an asynchronous iterator. Rows are rendered in batches in a
+    worker thread, a rate the prefetch missed is looked up synchronously.
+    """
+    chunks = render_rows(in_chronological_order(report))
+    # Every row but the first is two chunks, the comma and the row
+    take = sync_to_async(
+        lambda: b"".join(islice(chunks, 2 * STREAM_BATCH_SIZE)),
+        thread_sensitive=False,
+    )
+    while batch := await take():
+        yield batch
+
+
+class AsyncAPIView(View):
+    """
+    Natively asynchronous views for ASGI deployments. They wait for NBP without
+    holding a worker thread, so a single process can keep many report requests
+    in flight. CSRF exempt, just like DRF's APIView. Query parameters mean the
+    same as in the synchronous views, while the request body is always parsed
+    whole (?stream=1 only streams the response).
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        # query_params for the helpers shared with the synchronous views
+        self.query = Request(request)
+
+    @staticmethod
+    def parse(request):
+        return loads(request.body or b"{}")
+
+    async def validate(self, data):
+        # Validation is CPU bound (or waits for the process pool), it would
+        # stall every other request in flight on the event loop
+        return await sync_to_async(generate_report, thread_sensitive=False)(data)
+
+    async def prefetch_rates(self, report):
+        with timed("rates"):
+            await aprefetch_exchange_rates(rate_pairs(report))
+
+    async def render(self, render, report):
+        # Rates are cached by now, a lookup which failed to prefetch is retried
+        # in a worker thread rather than blocking the event loop
+        return await sync_to_async(render, thread_sensitive=False)(report)
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            # The same body DRF's exception handler responds with
+            if isinstance(exc.detail, (list, dict)):
+                return json_response(exc.detail, status=exc.status_code)
+            return json_response({"detail": exc.detail}, status=exc.status_code)
+
+
+class AsyncReportView(AsyncAPIView):
+    """POST /report/ with ?date_from, ?date_to, pagination and ?stream=1"""
+
+    async def post(self, request):
+        report, errors = await self.validate(self.parse(request))
+        if errors:
+            return json_response(errors, status=400)
+
+        report = filter_by_date(report, self.query)
+        paginator = ReportPagination()
+        if paginator.is_requested(self.query):
+            # Only rows of the page are converted, so only their rates are needed
+            page = paginator.paginate_queryset(report, self.query)
+            await self.prefetch_rates(page)
+            rows = await self.render(render_page, page)
+            return json_response(paginator.get_paginated_response(rows).data)
+
+        await self.prefetch_rates(report)
+        if streaming_requested(self.query):
+            return StreamingHttpResponse(
+                arender_rows(report), content_type="application/json"
+            )
+        return json_response(await self.render(render_report, report))
+
+
+class AsyncCustomerReportView(AsyncAPIView):
+    """
+    POST /customer-report/ (?append=1 included) waiting for NBP asynchronously.
+    Reading a stored report doesn't wait for NBP, GET is served by the
+    synchronous view in a worker thread, with its ETags, cache and query
+    parameters.
+    """
+
+    async def post(self, request):
+        data = self.parse(request)
+        customer_id = data.pop("customer_id", None)
+
+        report, errors = await self.validate(data)
+        if errors:
+            return json_response(errors, status=400)
+
+        await self.prefetch_rates(report)
+        rows = await self.render(render_report, report)
+        customer_report = await sync_to_async(save_report)(
+            customer_id,
+            rows,
+            append=query_flag(self.query, "append"),
+            payments=report,
+        )
+        return json_response({"customer_id": customer_report.id}, status=201)
+
+    async def get(self, request, customer_id=None):
+        # A DRF response is rendered by Django's handler
+        return await sync_to_async(customer_report_view)(
+            request, customer_id=customer_id
+        )
@@ -0,0 +1,56 @@
+import hashlib
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import parse_etags
+
+from reports.models import Report
+
+
+def content_key(customer_id: int, version: int, request) -> str:
+    # Links of paginated responses depend on the host, so the full url is used
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return f"customer-report:{customer_id}:{version}:{url}"
+
+
+def get_report_version(customer_id: int) -> Optional[int]:
+    """
+    Current version of a report, None when it does not exist. Rendered
+    responses are cached under it, so a write bumping it invalidates all of
+    them at once. It's always read from the database, a cached copy could
+    outlive the write in other processes or a rolled back transaction.
+    """
+    return (
+        Report.objects.filter(id=customer_id).values_list("version", flat=True).first()
+    )
+
+
+def report_etag(customer_id: int, version: int, request) -> str:
+    """Weak, because the same report is served with different content encodings"""
+    query = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:16]
+    return f'W/"{customer_id}-{version}-{query}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    return "*" in etags or any(
+        tag.removeprefix("W/") == etag.removeprefix("W/") for tag in etags
+    )
+
+
+def get_rendered(
+    customer_id: int, version: int, request
+) -> Optional[Tuple[bytes, str]]:
+    """Rendered response and its content encoding"""
+    return cache.get(content_key(customer_id, version, request))
+
+
+def set_rendered(
+    customer_id: int, version: int, request, rendered: Tuple[bytes, str]
+) -> None:
+    cache.set(
+        content_key(customer_id, version, request),
+        rendered,
+        settings.CUSTOMER_REPORT_CACHE_TIMEOUT,
+    )
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+from reports.encoding import GZIP, ZSTD, available
+
+STORAGE_ENCODINGS = ("", "identity", GZIP, ZSTD)
+
+
+@register()
+def check_report_storage(app_configs, **kwargs):
+    """CUSTOMER_REPORT_STORAGE is found wrong at startup rather than on a write"""
+    encoding = settings.CUSTOMER_REPORT_STORAGE
+    if encoding not in STORAGE_ENCODINGS:
+        return [
+            Error(
+                f"Unknown CUSTOMER_REPORT_STORAGE {encoding!r}",
+                hint="Use one of: identity, gzip, zstd or leave it empty.",
+                id="reports.E001",
+            )
+        ]
+    if not available(encoding):
+        return [
+            Error(
+                f"CUSTOMER_REPORT_STORAGE {encoding!r} needs a package to be installed",
+                hint="Install zstandard (see requirements.txt).",
+                id="reports.E002",
+            )
+        ]
+    return []
@@ -4,3 +4,5 @@ GBP = "GBP"
 PLN = "PLN"
 CURRENCIES = ((EUR, EUR), (USD, USD), (GBP, GBP), (PLN, PLN))
 NBP_API = "http://api.nbp.pl"
+# The API refuses to serve ranges longer than that
+NBP_MAX_RANGE_DAYS = 93
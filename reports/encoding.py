@@ -0,0 +1,114 @@
+import gzip
+import re
+from typing import Iterable, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+IDENTITY = ""
+GZIP = "gzip"
+ZSTD = "zstd"
+BROTLI = "br"
+# Levels suited to compressing responses on the fly
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+accept_encoding_re = re.compile(r"\s*([^\s;,]+)(?:\s*;\s*q=([0-9.]+))?")
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured("zstd compression requires the zstandard package")
+    return zstandard
+
+
+def brotli():
+    try:
+        import brotli
+    except ImportError:
+        raise ImproperlyConfigured("br compression requires the brotli package")
+    return brotli
+
+
+def available(encoding: str) -> bool:
+    """Whether the package needed for the encoding is installed"""
+    try:
+        {ZSTD: zstandard, BROTLI: brotli}.get(encoding, lambda: None)()
+    except ImproperlyConfigured:
+        return False
+    return True
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    if encoding == GZIP:
+        return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == ZSTD:
+        return zstandard().ZstdCompressor().compress(content)
+    if encoding == BROTLI:
+        return brotli().compress(content, quality=BROTLI_QUALITY)
+    return content
+
+
+def decompress(content: bytes, encoding: str) -> bytes:
+    if encoding == GZIP:
+        return gzip.decompress(content)
+    if encoding == ZSTD:
+        return zstandard().ZstdDecompressor().decompress(content)
+    if encoding == BROTLI:
+        return brotli().decompress(content)
+    return content
+
+
+def accepted_encodings(request) -> dict:
+    """Content codings of the Accept-Encoding header with their q values"""
+    header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    encodings = {}
+    for match in accept_encoding_re.finditer(header):
+        coding, q = match.groups()
+        try:
+            encodings[coding.lower()] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+    return encodings
+
+
+def accepts_encoding(request, encoding: str) -> bool:
+    encodings = accepted_encodings(request)
+    return encodings.get(encoding, encodings.get("*", 0)) > 0
+
+
+def negotiate_encoding(request, encodings: Iterable[str]) -> Optional[str]:
+    """
+    The encoding the client prefers out of the given ones, ties are resolved
+    by their order. None if it accepts none of them.
+    """
+    accepted = accepted_encodings(request)
+    best, best_q = None, 0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def encoded_response(
+    request, content: bytes, encoding: str, content_type: str = "application/json"
+) -> HttpResponse:
+    """
+    Passes already compressed content through when the client accepts its
+    encoding, decompresses it otherwise.
+    """
+    if encoding == IDENTITY:
+        return HttpResponse(content, content_type=content_type)
+    if accepts_encoding(request, encoding):
+        response = HttpResponse(content, content_type=content_type)
+        response["Content-Encoding"] = encoding
+    else:
+        response = HttpResponse(
+            decompress(content, encoding), content_type=content_type
+        )
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
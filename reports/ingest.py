@@ -0,0 +1,197 @@
+"""
+Bulk inserts of validated payments into the Payment tables. Card,
+DirectPayment and PayByLink use multi-table inheritance, which bulk_create
+refuses: rows of the Payment table are inserted first, returning their ids,
+which become the primary keys of the child rows inserted with executemany.
+On PostgreSQL both tables are loaded with COPY instead, ids are taken from
+the Payment sequence up front.
+
+Rows are written with plain SQL, without model instances, that's where most
+of the time of bulk_create goes. Every payment belongs to the customer report
+it was submitted with.
+"""
+
+import csv
+import io
+from typing import Dict, Iterable, List, Optional, Type
+
+from django.db import connection, transaction
+
+from reports.models import Card, DirectPayment, PayByLink, Payment, Report
+from reports.validation import ValidatedPayment
+
+BATCH_SIZE = 5000
+PAYMENT_MODELS = (Card, DirectPayment, PayByLink)
+INSERT = "insert"
+COPY = "copy"
+
+
+def table_fields(model: Type[Payment]):
+    """Concrete fields of the model's own table except for its primary key"""
+    return [
+        field for field in model._meta.local_concrete_fields if not field.primary_key
+    ]
+
+
+def table_columns(model: Type[Payment], fields) -> str:
+    quote = connection.ops.quote_name
+    columns = [model._meta.pk.column] + [field.column for field in fields]
+    return ", ".join(map(quote, columns))
+
+
+def db_values(fields, row: dict) -> list:
+    """Values of the fields as Django would send them in an INSERT"""
+    return [
+        field.get_db_prep_save(
+            row[field.attname] if field.attname in row else field.get_default(),
+            connection,
+        )
+        for field in fields
+    ]
+
+
+def insert_parents(rows: List[dict]) -> List[int]:
+    """Inserts Payment rows, returns their ids in the order of `rows`"""
+    fields = table_fields(Payment)
+    quote = connection.ops.quote_name
+    # The primary key is left to the database
+    columns = ", ".join(quote(field.column) for field in fields)
+    placeholders = "({})".format(", ".join(["%s"] * len(fields)))
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            params = []
+            for row in batch:
+                params.extend(db_values(fields, row))
+            cursor.execute(
+                "INSERT INTO {} ({}) VALUES {} RETURNING {}".format(
+                    quote(Payment._meta.db_table),
+                    columns,
+                    ", ".join([placeholders] * len(batch)),
+                    quote(Payment._meta.pk.column),
+                ),
+                params,
+            )
+            ids.extend(pk for (pk,) in cursor.fetchall())
+    return ids
+
+
+def insert_payments(model: Type[Payment], rows: List[dict]) -> None:
+    if connection.features.can_return_rows_from_bulk_insert:
+        ids = insert_parents(rows)
+    else:
+        parents = Payment.objects.bulk_create(
+            [
+                Payment(
+                    **{
+                        f.attname: row[f.attname]
+                        for f in table_fields(Payment)
+                        if f.attname in row
+                    }
+                )
+                for row in rows
+            ]
+        )
+        ids = [parent.pk for parent in parents]
+    fields = table_fields(model)
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(model._meta.db_table),
+        table_columns(model, fields),
+        ", ".join(["%s"] * (len(fields) + 1)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            sql, [[pk, *db_values(fields, row)] for pk, row in zip(ids, rows)]
+        )
+
+
+def copy_rows(cursor, model: Type[Payment], fields, rows: Iterable[list]) -> None:
+    buffer = io.StringIO()
+    # Every value is quoted, none of the columns is nullable
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        connection.ops.quote_name(model._meta.db_table), table_columns(model, fields)
+    )
+    buffer.seek(0)
+    if hasattr(cursor, "copy_expert"):
+        # psycopg2
+        cursor.copy_expert(sql, buffer)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def copy_payments(model: Type[Payment], rows: List[dict]) -> None:
+    parent_fields, fields = table_fields(Payment), table_fields(model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s))"
+            " FROM generate_series(1, %s)",
+            [Payment._meta.db_table, Payment._meta.pk.column, len(rows)],
+        )
+        ids = [pk for (pk,) in cursor.fetchall()]
+        copy_rows(
+            cursor,
+            Payment,
+            parent_fields,
+            ([pk, *db_values(parent_fields, row)] for pk, row in zip(ids, rows)),
+        )
+        copy_rows(
+            cursor,
+            model,
+            fields,
+            ([pk, *db_values(fields, row)] for pk, row in zip(ids, rows)),
+        )
+
+
+def save_payments(
+    payments: Iterable[ValidatedPayment],
+    report: Report,
+    method: Optional[str] = None,
+) -> int:
+    """
+    Persists validated payments of the report in batches of BATCH_SIZE, either
+    with COPY (PostgreSQL only) or with INSERTs. By default COPY is used where
+    available. Returns the number of saved payments.
+    """
+    if method is None:
+        method = COPY if connection.vendor == "postgresql" else INSERT
+    save = copy_payments if method == COPY else insert_payments
+
+    by_model: Dict[Type[Payment], List[dict]] = {}
+    for payment in payments:
+        model = payment.serializer.Meta.model
+        by_model.setdefault(model, []).append(
+            {**payment.validated_data, "report_id": report.id}
+        )
+    with transaction.atomic():
+        for model, rows in by_model.items():
+            for start in range(0, len(rows), BATCH_SIZE):
+                save(model, rows[start : start + BATCH_SIZE])
+    return sum(len(rows) for rows in by_model.values())
+
+
+def delete_payments(report: Report) -> None:
+    """Deletes payments saved with the report, rows of the child tables first"""
+    quote = connection.ops.quote_name
+    payments = quote(Payment._meta.db_table)
+    with connection.cursor() as cursor:
+        for model in PAYMENT_MODELS:
+            cursor.execute(
+                "DELETE FROM {} WHERE {} IN (SELECT {} FROM {} WHERE {} = %s)".format(
+                    quote(model._meta.db_table),
+                    quote(model._meta.pk.column),
+                    quote(Payment._meta.pk.column),
+                    payments,
+                    quote(Payment._meta.get_field("report").column),
+                ),
+                [report.id],
+            )
+        cursor.execute(
+            "DELETE FROM {} WHERE {} = %s".format(
+                payments, quote(Payment._meta.get_field("report").column)
+            ),
+            [report.id],
+        )
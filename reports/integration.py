@@ -1,29 +1,588 @@
+import asyncio
 import datetime
-from functools import lru_cache
+import logging
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
 
+import httpx
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from reports.constants import NBP_API, PLN
+from reports.constants import NBP_API, NBP_MAX_RANGE_DAYS, PLN
+from reports.metrics import registry
+from reports.models import ExchangeRate
 
+RateKey = Tuple[str, datetime.date]
 
-# This could potentailly grow without bound (however unlikely it is)
-@lru_cache
-def get_exchange_rate(currency: str, date: datetime.date) -> float:
+nbp_request_duration = registry.histogram(
+    "nbp_request_duration_seconds",
+    "Time of a request to the NBP API, retries included",
+    ("client", "status"),
+)
+
+# Cached for dates on which NBP did not publish a table (weekends, holidays)
+NO_RATE = object()
+
+
+def rate_cache_key(currency: str, date: datetime.date) -> RateKey:
     """
-    Assuming we can ask for exchange rates once a day we can cache the anwser for that long.
-    We can make this as granular as we want. Asking the API for exchange
-    rated on every request is probably a bad idea.
+    NBP publishes one table a day, so every timestamp within the same (UTC)
+    business date maps onto the same cache entry.
     """
-    if currency == PLN:
-        return 1.0
-    currency = currency.lower()
-    date = str(date.date())
-    response = requests.get(
-        f"{NBP_API}/api/exchangerates/rates/a/{currency}/{date}/{date}",
-        params={"format": "json"},
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return currency.upper(), date
+
+
+class RateCache:
+    """
+    Thread safe LRU cache with a size bound and a time to live.
+    Keeps hit/miss/eviction counters so its effectiveness can be inspected,
+    in total and per currency (the first part of a (currency, date) key).
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 24 * 60 * 60, timer=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer or time.monotonic
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        # (event, currency): count
+        self._counts = Counter()
+
+    @staticmethod
+    def label(key: Hashable) -> str:
+        return key[0] if isinstance(key, tuple) and key else ""
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self._timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._counts["hits", self.label(key)] += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            self._counts["misses", self.label(key)] += 1
+            return default
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None) -> None:
+        """Caches the value for `ttl` seconds, the cache's own ttl by default"""
+        with self._lock:
+            expires_at = self._timer() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._counts["evictions", self.label(evicted)] += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drops a single entry or, when no key is given, the whole cache"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def counts(self, event: str) -> List[Tuple[Tuple[str], int]]:
+        """Hits, misses or evictions per currency"""
+        with self._lock:
+            return [
+                ((label,), count)
+                for (counted, label), count in self._counts.items()
+                if counted == event
+            ]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > self._timer()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls until
+    `reset_timeout` seconds pass. Then a single trial call is let through which
+    either closes the circuit again or keeps it open for another period.
+    """
+
+    def __init__(
+        self, failure_threshold: int = 5, reset_timeout: float = 30, timer=None
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._timer = timer or time.monotonic
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._timer() - self.opened_at >= self.reset_timeout:
+                # Half open, postpone other calls until the trial one finishes
+                self.opened_at = self._timer()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self._timer()
+
+
+class NBPClient:
+    """
+    Keeps a pool of keep-alive connections to the NBP API. Every call is bounded
+    by connect/read timeouts, retried with exponential backoff on connection
+    errors and 5xx responses, and short-circuited while the API is down.
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        base_url: str = NBP_API,
+        timeout: Tuple[float, float] = (3.05, 10),
+        retries: int = 3,
+        backoff_factor: float = 0.3,
+        pool_size: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path: str, **params) -> requests.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable, circuit is open")
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                f"{self.base_url}{path}", params=params, timeout=self.timeout
+            )
+        except requests.RequestException:
+            nbp_request_duration.observe(time.perf_counter() - start, "sync", "error")
+            self.breaker.record_failure()
+            raise
+        nbp_request_duration.observe(
+            time.perf_counter() - start, "sync", str(response.status_code)
+        )
+        if response.status_code in self.retry_statuses:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+class AsyncNBPClient:
+    """
+    asyncio counterpart of NBPClient sharing its circuit breaker. Connections are
+    pooled per event loop and identical requests in flight at the same time
+    share a single round trip to the API.
+    """
+
+    retry_statuses = NBPClient.retry_statuses
+
+    def __init__(
+        self,
+        base_url: str = NBP_API,
+        timeout: Tuple[float, float] = (3.05, 10),
+        retries: int = 3,
+        backoff_factor: float = 0.3,
+        pool_size: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.limits = httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self.transport = transport
+        self._clients = weakref.WeakKeyDictionary()
+        self._in_flight = weakref.WeakKeyDictionary()
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop] = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self.transport,
+            )
+        return self._clients[loop]
+
+    async def get(self, path: str, **params) -> httpx.Response:
+        in_flight = self._in_flight.setdefault(asyncio.get_running_loop(), {})
+        key = (path, tuple(sorted(params.items())))
+        if key not in in_flight:
+            in_flight[key] = asyncio.ensure_future(self._get(path, params))
+            in_flight[key].add_done_callback(lambda _: in_flight.pop(key, None))
+        return await asyncio.shield(in_flight[key])
+
+    async def _get(self, path: str, params: dict) -> httpx.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable, circuit is open")
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                response = await self.client().get(path, params=params)
+            except httpx.TransportError:
+                if attempt < self.retries:
+                    continue
+                nbp_request_duration.observe(
+                    time.perf_counter() - start, "async", "error"
+                )
+                self.breaker.record_failure()
+                raise
+            if response.status_code in self.retry_statuses and attempt < self.retries:
+                continue
+            break
+        nbp_request_duration.observe(
+            time.perf_counter() - start, "async", str(response.status_code)
+        )
+        if response.status_code in self.retry_statuses:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+nbp_client = NBPClient(
+    base_url=settings.NBP_API_URL,
+    timeout=(settings.NBP_API_CONNECT_TIMEOUT, settings.NBP_API_READ_TIMEOUT),
+    retries=settings.NBP_API_RETRIES,
+    pool_size=settings.NBP_API_POOL_SIZE,
+    breaker=CircuitBreaker(
+        failure_threshold=settings.NBP_API_CIRCUIT_THRESHOLD,
+        reset_timeout=settings.NBP_API_CIRCUIT_RESET_TIMEOUT,
+    ),
+)
+
+async_nbp_client = AsyncNBPClient(
+    base_url=settings.NBP_API_URL,
+    timeout=(settings.NBP_API_CONNECT_TIMEOUT, settings.NBP_API_READ_TIMEOUT),
+    retries=settings.NBP_API_RETRIES,
+    pool_size=settings.NBP_API_POOL_SIZE,
+    breaker=nbp_client.breaker,
+)
+
+rate_cache = RateCache(
+    maxsize=settings.EXCHANGE_RATE_CACHE_SIZE, ttl=settings.EXCHANGE_RATE_CACHE_TTL
+)
+
+for event in ("hits", "misses", "evictions"):
+    registry.function(
+        f"exchange_rate_cache_{event}_total",
+        f"Exchange rate cache {event}",
+        "counter",
+        lambda event=event: rate_cache.counts(event),
+        ("currency",),
     )
+registry.function(
+    "exchange_rate_cache_size",
+    "Exchange rates currently cached",
+    "gauge",
+    lambda: [((), len(rate_cache))],
+)
+registry.function(
+    "exchange_rate_cache_maxsize",
+    "Exchange rates the cache holds at most",
+    "gauge",
+    lambda: [((), rate_cache.maxsize)],
+)
+exchange_rate_errors = registry.counter(
+    "exchange_rate_lookup_errors_total",
+    "Payments left without amount_in_pln as their rate could not be found",
+    ("currency",),
+)
+
+
+def parse_rate(response) -> float:
     if response.status_code != 200:
         # Exception is raised in order not to cache an invalid anwser
-        raise RuntimeError(f"{NBP_API} could not be reached")
+        raise RuntimeError(f"{nbp_client.base_url} could not be reached")
     data = response.json()
     return data["rates"][0]["mid"]
+
+
+def parse_rates(response) -> Dict[datetime.date, float]:
+    if response.status_code == 404:
+        # NBP responds with 404 when there is no table in the whole range
+        return {}
+    if response.status_code != 200:
+        raise RuntimeError(f"{nbp_client.base_url} could not be reached")
+    data = response.json()
+    return {
+        datetime.date.fromisoformat(rate["effectiveDate"]): rate["mid"]
+        for rate in data["rates"]
+    }
+
+
+def fetch_exchange_rate(currency: str, date: datetime.date) -> float:
+    currency = currency.lower()
+    response = nbp_client.get(
+        f"/api/exchangerates/rates/a/{currency}/{date}/{date}", format="json"
+    )
+    return parse_rate(response)
+
+
+async def afetch_exchange_rate(currency: str, date: datetime.date) -> float:
+    currency = currency.lower()
+    response = await async_nbp_client.get(
+        f"/api/exchangerates/rates/a/{currency}/{date}/{date}", format="json"
+    )
+    return parse_rate(response)
+
+
+def fetch_exchange_rates(
+    currency: str, start: datetime.date, end: datetime.date
+) -> Dict[datetime.date, float]:
+    """Asks the API for all rates published between start and end (inclusive)"""
+    currency = currency.lower()
+    response = nbp_client.get(
+        f"/api/exchangerates/rates/a/{currency}/{start}/{end}/", format="json"
+    )
+    return parse_rates(response)
+
+
+async def afetch_exchange_rates(
+    currency: str, start: datetime.date, end: datetime.date
+) -> Dict[datetime.date, float]:
+    currency = currency.lower()
+    response = await async_nbp_client.get(
+        f"/api/exchangerates/rates/a/{currency}/{start}/{end}/", format="json"
+    )
+    return parse_rates(response)
+
+
+def stored_exchange_rates(
+    currency: str, start: datetime.date, end: datetime.date
+) -> Dict[datetime.date, float]:
+    """Reads rates between start and end (inclusive) from the ExchangeRate table"""
+    rates = ExchangeRate.objects.filter(
+        currency=currency.upper(), date__range=(start, end)
+    ).values_list("date", "mid")
+    return dict(rates)
+
+
+def lookup_exchange_rates(
+    currency: str, start: datetime.date, end: datetime.date
+) -> Dict[datetime.date, float]:
+    """In offline mode rates come from the database only, never from the API"""
+    if settings.EXCHANGE_RATES_OFFLINE:
+        return stored_exchange_rates(currency, start, end)
+    return fetch_exchange_rates(currency, start, end)
+
+
+def lookup_exchange_rate(currency: str, date: datetime.date) -> float:
+    if not settings.EXCHANGE_RATES_OFFLINE:
+        return fetch_exchange_rate(currency, date)
+    rate = stored_exchange_rates(currency, date, date).get(date)
+    if rate is None:
+        raise RuntimeError(f"No stored exchange rate for {currency} on {date}")
+    return rate
+
+
+def split_into_ranges(
+    dates: Iterable[datetime.date],
+) -> List[Tuple[datetime.date, datetime.date]]:
+    """Groups dates into the fewest ranges the API is willing to serve at once"""
+    ranges = []
+    for date in sorted(dates):
+        if ranges and (date - ranges[-1][0]).days < NBP_MAX_RANGE_DAYS:
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
+    return [(start, end) for start, end in ranges]
+
+
+def run_concurrently(func, calls: List[tuple]) -> list:
+    """
+    Calls func with every tuple of arguments using up to EXCHANGE_RATE_WORKERS
+    threads. Results come back in order, failures are logged and returned in
+    place of the result.
+    """
+
+    def call(args):
+        try:
+            return func(*args)
+        except Exception as e:
+            logging.exception(e)
+            return e
+
+    workers = min(settings.EXCHANGE_RATE_WORKERS, len(calls))
+    if workers <= 1 or settings.EXCHANGE_RATES_OFFLINE:
+        # Database connections are per thread, stored rates are read in the caller's
+        return [call(args) for args in calls]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(call, calls))
+
+
+async def gather_concurrently(func, calls: List[tuple]) -> list:
+    """asyncio counterpart of run_concurrently"""
+
+    async def call(args):
+        try:
+            return await func(*args)
+        except Exception as e:
+            logging.exception(e)
+            return e
+
+    return await asyncio.gather(*(call(args) for args in calls))
+
+
+def missing_rate_ranges(
+    pairs: Iterable[Tuple[str, datetime.date]],
+) -> Tuple[Dict[str, set], List[Tuple[str, datetime.date, datetime.date]]]:
+    """Days missing from the cache per currency and ranges covering them"""
+    missing = defaultdict(set)
+    for currency, date in pairs:
+        if currency == PLN:
+            continue
+        currency, date = rate_cache_key(currency, date)
+        if (currency, date) not in rate_cache:
+            missing[currency].add(date)
+    ranges = [
+        (currency, start, end)
+        for currency, dates in missing.items()
+        for start, end in split_into_ranges(dates)
+    ]
+    return missing, ranges
+
+
+def cache_rate_ranges(missing: Dict[str, set], ranges: list, results: list) -> list:
+    """Caches downloaded ranges, returns days of the ranges which failed"""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    unresolved = []
+    for (currency, start, end), rates in zip(ranges, results):
+        dates = [date for date in missing[currency] if start <= date <= end]
+        if isinstance(rates, Exception):
+            unresolved.extend((currency, date) for date in dates)
+            continue
+        for date in dates:
+            if date in rates:
+                rate_cache.set((currency, date), rates[date])
+            elif settings.EXCHANGE_RATES_OFFLINE:
+                # A missing row only means that it has not been loaded yet
+                rate_cache.set(
+                    (currency, date), NO_RATE, settings.EXCHANGE_RATE_MISSING_TTL
+                )
+            elif date < today:
+                # Today's table might not be published yet
+                rate_cache.set((currency, date), NO_RATE)
+    return unresolved
+
+
+def prefetch_exchange_rates(pairs: Iterable[Tuple[str, datetime.date]]) -> None:
+    """
+    Fills the cache for all (currency, date) pairs with a single range request
+    per currency, so converting the payments afterwards does not hit the network.
+    Requests for different currencies run concurrently. Days of ranges which
+    failed to download are then retried one by one, also concurrently.
+    """
+    missing, ranges = missing_rate_ranges(pairs)
+    results = run_concurrently(lookup_exchange_rates, ranges)
+    unresolved = cache_rate_ranges(missing, ranges, results)
+    run_concurrently(get_exchange_rate, unresolved)
+
+
+async def aprefetch_exchange_rates(pairs: Iterable[Tuple[str, datetime.date]]) -> None:
+    """Same as prefetch_exchange_rates without blocking the event loop"""
+    if settings.EXCHANGE_RATES_OFFLINE:
+        # The ORM is synchronous, stored rates are read in a worker thread
+        return await sync_to_async(prefetch_exchange_rates)(list(pairs))
+    missing, ranges = missing_rate_ranges(pairs)
+    results = await gather_concurrently(afetch_exchange_rates, ranges)
+    unresolved = cache_rate_ranges(missing, ranges, results)
+    await gather_concurrently(aget_exchange_rate, unresolved)
+
+
+def get_exchange_rate(currency: str, date: datetime.date) -> float:
+    """
+    Assuming we can ask for exchange rates once a day we can cache the anwser for that long.
+    Lookups are keyed on the business date, so all payments made on the same day
+    share a single request to the API.
+    """
+    if currency == PLN:
+        return 1.0
+    key = rate_cache_key(currency, date)
+    rate = rate_cache.get(key)
+    if rate is None:
+        rate = lookup_exchange_rate(*key)
+        rate_cache.set(key, rate)
+    if rate is NO_RATE:
+        raise RuntimeError(f"No exchange rate for {key[0]} on {key[1]}")
+    return rate
+
+
+async def aget_exchange_rate(currency: str, date: datetime.date) -> float:
+    if currency == PLN:
+        return 1.0
+    key = rate_cache_key(currency, date)
+    rate = rate_cache.get(key)
+    if rate is None:
+        if settings.EXCHANGE_RATES_OFFLINE:
+            rate = await sync_to_async(lookup_exchange_rate)(*key)
+        else:
+            rate = await afetch_exchange_rate(*key)
+        rate_cache.set(key, rate)
+    if rate is NO_RATE:
+        raise RuntimeError(f"No exchange rate for {key[0]} on {key[1]}")
+    return rate
@@ -0,0 +1,154 @@
+"""
+Customer reports built in the background. Jobs are queued in the ReportJob
+table and claimed with a conditional UPDATE, so any number of worker
+processes can share the queue on any database without a broker.
+
+A job is retried when its worker dies: the lease of a running job is renewed
+while it's being built, once it expires the job can be claimed again. The
+report is saved in the same transaction which marks the job as done, a
+worker which lost its lease rolls back the report along with the outcome, so
+every job changes the report once (appending to it included).
+"""
+
+import datetime
+import logging
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+
+from reports.models import ReportJob
+from reports.parsers import loads
+from reports.views import generate_report, prefetch_rates, render_report, save_report
+
+
+class LeaseLost(Exception):
+    """The job was claimed again by another worker"""
+
+
+def lease_expiry() -> datetime.datetime:
+    return timezone.now() + datetime.timedelta(seconds=settings.REPORT_JOB_LEASE)
+
+
+def claimable(now: datetime.datetime) -> Q:
+    """Jobs never started and the ones abandoned by crashed workers"""
+    return Q(status=ReportJob.PENDING) | Q(
+        status=ReportJob.RUNNING, lease_expires_at__lt=now
+    )
+
+
+def fail_abandoned_jobs() -> int:
+    """Jobs whose workers crashed on every attempt are not retried again"""
+    now = timezone.now()
+    return ReportJob.objects.filter(
+        status=ReportJob.RUNNING,
+        lease_expires_at__lt=now,
+        attempts__gte=settings.REPORT_JOB_MAX_ATTEMPTS,
+    ).update(
+        status=ReportJob.FAILED,
+        errors={"detail": "The report could not be built"},
+        lease_expires_at=None,
+        finished_at=now,
+    )
+
+
+def claim_jobs(limit: int) -> List[ReportJob]:
+    """Takes up to `limit` jobs off the queue, oldest first"""
+    if limit <= 0:
+        return []
+    fail_abandoned_jobs()
+    now = timezone.now()
+    candidates = (
+        ReportJob.objects.filter(claimable(now))
+        .order_by("id")
+        .values_list("id", flat=True)[:limit]
+    )
+    claimed = []
+    for job_id in list(candidates):
+        # Other workers race for the same jobs, only one of the updates matches
+        if ReportJob.objects.filter(claimable(now), id=job_id).update(
+            status=ReportJob.RUNNING,
+            attempts=F("attempts") + 1,
+            lease_expires_at=lease_expiry(),
+        ):
+            claimed.append(job_id)
+    return list(ReportJob.objects.filter(id__in=claimed).order_by("id"))
+
+
+def renew_leases(jobs: Iterable[ReportJob]) -> None:
+    jobs = list(jobs)
+    if not jobs:
+        return
+    owned = Q()
+    for job in jobs:
+        owned |= Q(id=job.id, attempts=job.attempts)
+    ReportJob.objects.filter(owned, status=ReportJob.RUNNING).update(
+        lease_expires_at=lease_expiry()
+    )
+
+
+def finish_job(job: ReportJob, status: str, **fields) -> bool:
+    """
+    Records the outcome of a job, unless the lease was lost and the job was
+    claimed again in the meantime.
+    """
+    return bool(
+        ReportJob.objects.filter(
+            id=job.id, attempts=job.attempts, status=ReportJob.RUNNING
+        ).update(
+            status=status, lease_expires_at=None, finished_at=timezone.now(), **fields
+        )
+    )
+
+
+def release_job(job: ReportJob) -> bool:
+    """Puts the job back in the queue to be retried"""
+    return bool(
+        ReportJob.objects.filter(
+            id=job.id, attempts=job.attempts, status=ReportJob.RUNNING
+        ).update(status=ReportJob.PENDING, lease_expires_at=None)
+    )
+
+
+def build_report(job: ReportJob) -> bool:
+    """Builds the report of a claimed job, the same way POST /customer-report/ does"""
+    try:
+        data = loads(bytes(job.payload))
+        if not isinstance(data, dict):
+            raise ParseError("JSON parse error - expected an object")
+        report, errors = generate_report(data)
+        if errors:
+            return finish_job(job, ReportJob.FAILED, errors=errors)
+        prefetch_rates(report)
+        with transaction.atomic():
+            customer_report = save_report(
+                data.get("customer_id"),
+                render_report(report),
+                append=job.append,
+                payments=report,
+            )
+            if not finish_job(job, ReportJob.DONE, report=customer_report):
+                raise LeaseLost()
+    except LeaseLost:
+        return False
+    except ParseError as e:
+        return finish_job(job, ReportJob.FAILED, errors={"detail": str(e.detail)})
+    except Exception as e:
+        logging.exception(e)
+        if job.attempts < settings.REPORT_JOB_MAX_ATTEMPTS:
+            return release_job(job)
+        return finish_job(
+            job, ReportJob.FAILED, errors={"detail": "The report could not be built"}
+        )
+    return True
+
+
+def run_job(job: ReportJob) -> bool:
+    """build_report in a worker thread, which has a database connection of its own"""
+    try:
+        return build_report(job)
+    finally:
+        connection.close()
@@ -0,0 +1,101 @@
+import csv
+import datetime
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.constants import CURRENCIES, NBP_MAX_RANGE_DAYS, PLN
+from reports.integration import fetch_exchange_rates
+from reports.models import ExchangeRate
+
+BATCH_SIZE = 1000
+
+
+def date_windows(start: datetime.date, end: datetime.date):
+    """Splits [start, end] into windows the NBP API is willing to serve"""
+    while start <= end:
+        window_end = min(start + datetime.timedelta(days=NBP_MAX_RANGE_DAYS - 1), end)
+        yield start, window_end
+        start = window_end + datetime.timedelta(days=1)
+
+
+def read_json_dump(path: Path):
+    """
+    Accepts either a list of {"currency", "date", "mid"} records or NBP responses
+    ({"code": ..., "rates": [{"effectiveDate": ..., "mid": ...}]}), alone or in a list.
+    """
+    data = json.loads(path.read_text())
+    if isinstance(data, dict):
+        data = [data]
+    for item in data:
+        if "rates" in item:
+            for rate in item["rates"]:
+                yield item["code"], rate["effectiveDate"], rate["mid"]
+        else:
+            yield item["currency"], item["date"], item["mid"]
+
+
+def read_csv_dump(path: Path):
+    """Expects a header row with currency, date and mid columns"""
+    with path.open(newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["currency"], row["date"], row["mid"]
+
+
+class Command(BaseCommand):
+    help = "Loads NBP exchange rates into the ExchangeRate table from the API or a dump file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--currency",
+            nargs="+",
+            default=[code for code, _ in CURRENCIES if code != PLN],
+        )
+        parser.add_argument("--start", type=datetime.date.fromisoformat)
+        parser.add_argument(
+            "--end",
+            type=datetime.date.fromisoformat,
+            default=datetime.date.today(),
+        )
+        parser.add_argument("--file", type=Path, help="JSON or CSV dump of rates")
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            rates = self.read_file(options["file"])
+        elif options["start"]:
+            rates = self.fetch(options["currency"], options["start"], options["end"])
+        else:
+            raise CommandError("Either --file or --start has to be given")
+
+        objs = [
+            ExchangeRate(
+                currency=currency.upper(),
+                date=datetime.date.fromisoformat(str(date)),
+                mid=float(mid),
+            )
+            for currency, date, mid in rates
+        ]
+        ExchangeRate.objects.bulk_create(
+            objs,
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["currency", "date"],
+            update_fields=["mid"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(objs)} exchange rates"))
+
+    def read_file(self, path: Path):
+        if path.suffix == ".json":
+            return list(read_json_dump(path))
+        if path.suffix == ".csv":
+            return list(read_csv_dump(path))
+        raise CommandError(f"Unsupported dump format: {path.suffix}")
+
+    def fetch(self, currencies, start, end):
+        rates = []
+        for currency in currencies:
+            for window_start, window_end in date_windows(start, end):
+                fetched = fetch_exchange_rates(currency, window_start, window_end)
+                rates.extend((currency, date, mid) for date, mid in fetched.items())
+        return rates
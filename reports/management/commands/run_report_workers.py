@@ -0,0 +1,77 @@
+import logging
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reports.jobs import claim_jobs, renew_leases, run_job
+
+
+class Command(BaseCommand):
+    help = "Builds customer reports submitted to /customer-report/jobs/"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.REPORT_JOB_WORKERS,
+            help="Jobs built at the same time by this process",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.REPORT_JOB_POLL_INTERVAL,
+            help="Seconds between looks at the queue",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new jobs",
+        )
+
+    def handle(self, *args, **options):
+        workers, poll_interval = options["workers"], options["poll_interval"]
+        self.stopping = False
+        handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        done = 0
+        try:
+            with ThreadPoolExecutor(workers) as executor:
+                running = {}
+                while running or not self.stopping:
+                    # Leases of running jobs have to outlive the next round
+                    renew_leases(running.values())
+                    claimed = []
+                    if not self.stopping:
+                        claimed = claim_jobs(workers - len(running))
+                    for job in claimed:
+                        running[executor.submit(run_job, job)] = job
+                    if not running:
+                        if options["burst"]:
+                            break
+                        time.sleep(poll_interval)
+                        continue
+                    finished, _ = wait(
+                        running, timeout=poll_interval, return_when=FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        job = running.pop(future)
+                        if future.exception() is not None:
+                            # Its lease runs out and the job is retried
+                            logging.error(
+                                f"Report job {job.id} failed",
+                                exc_info=future.exception(),
+                            )
+                        done += 1
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Processed {done} report jobs"))
+
+    def stop(self, signum, frame):
+        """Running jobs are finished, no new ones are claimed"""
+        self.stopping = True
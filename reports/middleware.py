@@ -0,0 +1,110 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence
+
+from reports.encoding import BROTLI, GZIP, available, compress, negotiate_encoding
+from reports.metrics import phase_duration, request_duration, request_timings
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with brotli or gzip, whichever the client prefers
+    (brotli on a tie, when the package is installed). Responses smaller than
+    RESPONSE_COMPRESSION_MIN_SIZE and already encoded ones are left alone.
+    Streamed responses are gzipped as they go, except for asynchronous ones.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return response
+        if response.streaming and response.is_async:
+            return response
+        if not response.streaming and (
+            len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if response.streaming:
+            encoding = negotiate_encoding(request, (GZIP,))
+        else:
+            encodings = (BROTLI, GZIP) if available(BROTLI) else (GZIP,)
+            encoding = negotiate_encoding(request, encodings)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers["Content-Length"]
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The compressed body is no longer byte for byte the one tagged
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class TimingMiddleware:
+    """
+    Times the phases of every request (see reports.metrics.timed), reports
+    them in a Server-Timing header and adds them to the request histograms.
+    The body of a streamed response is not part of the total.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = {}
+        token = request_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, perf_counter() - start, timings)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = request_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, perf_counter() - start, timings)
+
+    @staticmethod
+    def finish(request, response, total, timings):
+        match = request.resolver_match
+        route = match.route if match is not None else "unmatched"
+        request_duration.observe(
+            total, route, request.method, str(response.status_code)
+        )
+        for phase, seconds in timings.items():
+            phase_duration.observe(seconds, route, phase)
+
+        if settings.SERVER_TIMING:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{phase};dur={seconds * 1000:.2f}"
+                for phase, seconds in [*timings.items(), ("total", total)]
+            )
+        return response
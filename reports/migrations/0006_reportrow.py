@@ -0,0 +1,128 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:08
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+
+ROW_FIELDS = (
+    "type",
+    "payment_mean",
+    "description",
+    "currency",
+    "amount",
+    "amount_in_pln",
+)
+
+
+def split_reports_into_rows(apps, schema_editor):
+    Report = apps.get_model("reports", "Report")
+    ReportRow = apps.get_model("reports", "ReportRow")
+    for report in Report.objects.iterator():
+        ReportRow.objects.bulk_create(
+            (
+                ReportRow(
+                    report=report,
+                    created_at=parse_datetime(row["date"]),
+                    **{field: row[field] for field in ROW_FIELDS},
+                )
+                for row in report.report
+            ),
+            batch_size=1000,
+        )
+
+
+def join_rows_into_reports(apps, schema_editor):
+    Report = apps.get_model("reports", "Report")
+    ReportRow = apps.get_model("reports", "ReportRow")
+    for report in Report.objects.iterator():
+        rows = ReportRow.objects.filter(report=report).order_by("created_at", "id")
+        report.report = [
+            {
+                "date": row.created_at,
+                **{field: getattr(row, field) for field in ROW_FIELDS},
+            }
+            for row in rows
+        ]
+        report.save(update_fields=["report"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0005_exchangerate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReportRow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                ("type", models.CharField(max_length=16)),
+                ("payment_mean", models.TextField()),
+                ("description", models.TextField(max_length=300)),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[
+                            ("EUR", "EUR"),
+                            ("USD", "USD"),
+                            ("GBP", "GBP"),
+                            ("PLN", "PLN"),
+                        ],
+                        max_length=3,
+                    ),
+                ),
+                (
+                    "amount",
+                    models.PositiveIntegerField(
+                        help_text="In units of currency's denomination"
+                    ),
+                ),
+                (
+                    "amount_in_pln",
+                    models.BigIntegerField(
+                        help_text="Empty when the exchange rate was not available",
+                        null=True,
+                    ),
+                ),
+                (
+                    "report",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rows",
+                        to="reports.report",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["report", "created_at", "id"],
+                        name="report_row_created_at",
+                    )
+                ],
+            },
+        ),
+        migrations.AlterField(
+            model_name="report",
+            name="report",
+            field=models.JSONField(
+                encoder=django.core.serializers.json.DjangoJSONEncoder, null=True
+            ),
+        ),
+        migrations.RunPython(split_reports_into_rows, join_rows_into_reports),
+        migrations.RemoveField(
+            model_name="report",
+            name="report",
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0006_reportrow"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reportrow",
+            index=models.Index(
+                fields=["report", "type", "created_at", "id"], name="report_row_type"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reportrow",
+            index=models.Index(
+                fields=["report", "currency", "created_at", "id"],
+                name="report_row_currency",
+            ),
+        ),
+    ]
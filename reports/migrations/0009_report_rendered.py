@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0008_report_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="report",
+            name="rendered",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="report",
+            name="rendered_encoding",
+            field=models.CharField(blank=True, max_length=8),
+        ),
+    ]
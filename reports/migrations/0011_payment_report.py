@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0010_reportjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="report",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="payments",
+                to="reports.report",
+            ),
+        ),
+    ]
@@ -1,4 +1,3 @@
-from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from localflavor.generic.models import IBANField
 
@@ -14,6 +13,10 @@ class Payment(models.Model):
         help_text="In units of currency's denomination"
     )
     description = models.TextField(max_length=300)
+    # The customer report the payment was submitted with, see PERSIST_PAYMENTS
+    report = models.ForeignKey(
+        "Report", null=True, related_name="payments", on_delete=models.CASCADE
+    )
 
 
 class PayByLink(Payment):
@@ -31,4 +34,90 @@ class Card(Payment):
 
 
 class Report(models.Model):
-    report = models.JSONField(encoder=DjangoJSONEncoder)
+    # Bumped on every change of the report's rows
+    version = models.PositiveIntegerField(default=1)
+    # Final JSON of the whole report, see CUSTOMER_REPORT_STORAGE setting
+    rendered = models.BinaryField(null=True)
+    rendered_encoding = models.CharField(max_length=8, blank=True)
+
+
+class ReportRow(models.Model):
+    """Single row of a customer's report, rows are ordered by created_at"""
+
+    report = models.ForeignKey(Report, related_name="rows", on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+    type = models.CharField(max_length=16)
+    payment_mean = models.TextField()
+    description = models.TextField(max_length=300)
+    currency = models.CharField(max_length=3, choices=CURRENCIES)
+    amount = models.PositiveIntegerField(
+        help_text="In units of currency's denomination"
+    )
+    amount_in_pln = models.BigIntegerField(
+        null=True, help_text="Empty when the exchange rate was not available"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["report", "created_at", "id"], name="report_row_created_at"
+            ),
+            models.Index(
+                fields=["report", "type", "created_at", "id"], name="report_row_type"
+            ),
+            models.Index(
+                fields=["report", "currency", "created_at", "id"],
+                name="report_row_currency",
+            ),
+        ]
+
+
+class ExchangeRate(models.Model):
+    currency = models.CharField(max_length=3, choices=CURRENCIES)
+    date = models.DateField()
+    mid = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["currency", "date"], name="unique_currency_date"
+            )
+        ]
+
+
+class ReportJob(models.Model):
+    """
+    Customer report to be built by a worker (see run_report_workers command).
+    A running job holds a lease which the worker keeps renewing, a job whose
+    lease expired is considered abandoned and is picked up again.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    )
+
+    status = models.CharField(max_length=8, choices=STATUSES, default=PENDING)
+    # Request body as it was submitted, parsed by the worker
+    payload = models.BinaryField()
+    append = models.BooleanField(default=False)
+    report = models.ForeignKey(
+        Report, null=True, related_name="jobs", on_delete=models.SET_NULL
+    )
+    # Validation errors of the payments or the reason the job failed
+    errors = models.JSONField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    lease_expires_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"], name="report_job_status"),
+        ]
@@ -0,0 +1,179 @@
+import base64
+import datetime
+import heapq
+import json
+import operator
+from typing import Dict, List, Optional
+
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from reports.validation import ValidatedPayment
+
+
+def parse_bound(value: str, param: str):
+    """A whole date or a datetime (naive ones are taken as UTC)"""
+    try:
+        parsed = parse_date(value) or parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({param: ["Expected an ISO 8601 date or datetime."]})
+    if isinstance(parsed, datetime.datetime) and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def date_filters(request) -> Dict[str, datetime.datetime]:
+    """
+    ?date_from and ?date_to (both inclusive) as created_at lookups.
+    A whole date covers the full (UTC) day, so the bounds can use an index.
+    """
+    filters = {}
+    if "date_from" in request.query_params:
+        bound = parse_bound(request.query_params["date_from"], "date_from")
+        if not isinstance(bound, datetime.datetime):
+            bound = start_of_day(bound)
+        filters["created_at__gte"] = bound
+    if "date_to" in request.query_params:
+        bound = parse_bound(request.query_params["date_to"], "date_to")
+        if isinstance(bound, datetime.datetime):
+            filters["created_at__lte"] = bound
+        else:
+            filters["created_at__lt"] = start_of_day(bound + datetime.timedelta(days=1))
+    return filters
+
+
+def start_of_day(date: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc)
+
+
+LOOKUPS = {"gte": operator.ge, "lte": operator.le, "lt": operator.lt}
+
+
+def filter_by_date(report: List[ValidatedPayment], request) -> List[ValidatedPayment]:
+    """Keeps payments made between ?date_from and ?date_to"""
+    checks = [
+        (LOOKUPS[lookup.split("__")[1]], bound)
+        for lookup, bound in date_filters(request).items()
+    ]
+    if not checks:
+        return report
+    return [
+        payment
+        for payment in report
+        if all(check(payment.validated_data["created_at"], b) for check, b in checks)
+    ]
+
+
+def filter_report_rows(rows: QuerySet, request) -> QuerySet:
+    """Narrows rows of a stored report down by date, ?type and ?currency"""
+    rows = rows.filter(**date_filters(request))
+    for field in ("type", "currency"):
+        if values := request.query_params.getlist(field):
+            rows = rows.filter(**{f"{field}__in": values})
+    return rows
+
+
+class ReportPagination(LimitOffsetPagination):
+    """
+    Pages of a report generated from a request body, selected either with
+    ?limit and ?offset or with ?limit and an opaque ?cursor (pass it empty to get
+    the first page) which points past the last row of the previous page.
+    Rows of a page are picked with a partial heap selection, the rest of the
+    report is never sorted nor serialized.
+    """
+
+    cursor_query_param = "cursor"
+
+    def is_requested(self, request) -> bool:
+        return any(
+            param in request.query_params
+            for param in (
+                self.limit_query_param,
+                self.offset_query_param,
+                self.cursor_query_param,
+            )
+        )
+
+    def paginate_queryset(self, report, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        self.cursor = self.decode_cursor(request)
+        self.offset = 0 if self.cursor_mode else self.get_offset(request)
+
+        # Position in the input breaks ties the same way a stable sort would
+        rows = (
+            (payment.validated_data["created_at"], position, payment)
+            for position, payment in enumerate(report)
+        )
+        if self.cursor:
+            rows = (row for row in rows if row[:2] > self.cursor)
+        rows = list(rows)
+        self.count = len(rows)
+
+        page = heapq.nsmallest(self.offset + self.limit, rows)[self.offset :]
+        self.last = page[-1][:2] if page else None
+        return [payment for _, _, payment in page]
+
+    def decode_cursor(self, request) -> Optional[tuple]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, position = json.loads(base64.urlsafe_b64decode(encoded))
+            created_at = datetime.datetime.fromisoformat(created_at)
+            # Can't be compared with the aware created_at of payments
+            if created_at.tzinfo is None:
+                raise ValueError("naive datetime")
+            return created_at, int(position)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, row: tuple) -> str:
+        created_at, position = row
+        return base64.urlsafe_b64encode(
+            json.dumps([created_at.isoformat(), position]).encode()
+        ).decode()
+
+    def get_next_link(self):
+        if self.offset + self.limit >= self.count:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if self.cursor_mode:
+            return replace_query_param(
+                url, self.cursor_query_param, self.encode_cursor(self.last)
+            )
+        return replace_query_param(
+            url, self.offset_query_param, self.offset + self.limit
+        )
+
+    def get_previous_link(self):
+        if self.cursor_mode:
+            # Cursors only move forward
+            return None
+        url = super().get_previous_link()
+        return url and remove_query_param(url, self.cursor_query_param)
+
+
+class CustomerReportPagination(CursorPagination):
+    """
+    Keyset pagination of stored report rows, pages are read straight from the
+    (report, created_at, id) index no matter how long the report is.
+    """
+
+    ordering = ("created_at", "id")
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def is_requested(self, request) -> bool:
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
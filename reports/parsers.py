@@ -0,0 +1,31 @@
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+def loads(content: bytes):
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError as exc:
+        raise ParseError(f"JSON parse error - {exc}")
+
+
+class ORJSONParser(JSONParser):
+    """
+    Drop-in replacement of DRF's JSONParser using orjson. Like DRF's strict
+    mode NaN and Infinity are rejected.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        content = stream.read() if stream is not None else b""
+        if codecs.lookup(encoding).name != "utf-8":
+            try:
+                content = content.decode(encoding)
+            except UnicodeDecodeError as exc:
+                raise ParseError(f"JSON parse error - {exc}")
+        return loads(content)
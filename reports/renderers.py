@@ -0,0 +1,31 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from reports.metrics import timed
+
+# Datetimes and UUIDs are serialized natively by orjson, anything else it does
+# not know (Decimals, lazy strings, querysets...) goes through DRF's encoder
+encoder = JSONEncoder()
+
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data, indent: bool = False) -> bytes:
+    option = OPTIONS | orjson.OPT_INDENT_2 if indent else OPTIONS
+    return orjson.dumps(data, default=encoder.default, option=option)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Drop-in replacement of DRF's JSONRenderer using orjson. Output is always
+    compact UTF-8, an indent requested by the client is rendered as two spaces.
+    """
+
+    @timed("render")
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        return dumps(data, indent=bool(indent))
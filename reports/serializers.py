@@ -1,13 +1,21 @@
 import logging
+from contextlib import contextmanager, nullcontext
 from typing import OrderedDict
 
-from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework import serializers
-from rest_framework.fields import JSONField
 
-from reports.integration import get_exchange_rate
-from reports.models import Card, DirectPayment, PayByLink, Payment, Report
-from reports.utils import mask_card_number
+from reports.integration import exchange_rate_errors, get_exchange_rate
+from reports.models import (
+    Card,
+    DirectPayment,
+    PayByLink,
+    Payment,
+    Report,
+    ReportJob,
+    ReportRow,
+)
+from reports.utils import mask_card_number, mask_card_numbers
+from reports.validators import iban_validator, prechecked_cards
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -47,6 +55,7 @@ class PaymentSerializer(serializers.ModelSerializer):
             exchange_rate = get_exchange_rate(currency, date)
         except Exception as e:
             logging.exception(e)
+            exchange_rate_errors.inc(currency)
             return None
         return int(obj.get("amount") * exchange_rate)
 
@@ -57,6 +66,13 @@ class PaymentSerializer(serializers.ModelSerializer):
             [(key, val) for key, val in ret.items() if key in self.return_fields]
         )
 
+    def batch(self, items):
+        """
+        Context in which a batch of items is validated with this instance,
+        a chance to do per row work for all of them at once.
+        """
+        return nullcontext()
+
     def get_type(self, obj):
         return self.payment_type
 
@@ -70,6 +86,16 @@ class DirectPaymentSerializer(PaymentSerializer):
     class Meta:
         model = DirectPayment
         fields = PaymentSerializer.Meta.fields + ("iban",)
+        extra_kwargs = {"iban": {"validators": [iban_validator]}}
+
+    def batch(self, items):
+        ibans = [
+            # As the CharField would clean them
+            str(item["iban"]).strip()
+            for item in items
+            if isinstance(item, dict) and isinstance(item.get("iban"), (str, int))
+        ]
+        return iban_validator.prechecked(ibans)
 
     def get_payment_mean(self, obj):
         return obj.get("iban")
@@ -86,9 +112,30 @@ class CardPaymentSerializer(PaymentSerializer):
             "card_number",
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.masked_card_numbers = {}
+
+    @contextmanager
+    def batch(self, items):
+        card_numbers = [
+            # As the CharField would clean them
+            str(item["card_number"]).strip()
+            for item in items
+            if isinstance(item, dict)
+            and isinstance(item.get("card_number"), (str, int))
+        ]
+        with prechecked_cards(card_numbers):
+            yield
+        self.masked_card_numbers.update(
+            zip(card_numbers, mask_card_numbers(card_numbers))
+        )
+
     def get_payment_mean(self, obj):
         card_number = obj.get("card_number")
-        masked_card_number = mask_card_number(card_number)
+        masked_card_number = self.masked_card_numbers.get(card_number)
+        if masked_card_number is None:
+            masked_card_number = mask_card_number(card_number)
         return (
             f"{obj.get('cardholder_name')} "
             f"{obj.get('cardholder_surnamename')} "
@@ -107,9 +154,55 @@ class ByLinkPaymentSerializer(PaymentSerializer):
         return obj.get("bank")
 
 
+# In the order in which payments end up in a report before sorting
+PAYMENT_SERIALIZERS = {
+    "dp": DirectPaymentSerializer,
+    "card": CardPaymentSerializer,
+    "pay_by_link": ByLinkPaymentSerializer,
+}
+
+
+class ReportRowSerializer(serializers.ModelSerializer):
+    date = serializers.DateTimeField(source="created_at")
+
+    class Meta:
+        model = ReportRow
+        fields = (
+            "date",
+            "type",
+            "payment_mean",
+            "description",
+            "currency",
+            "amount",
+            "amount_in_pln",
+        )
+
+
 class ReportSerializer(serializers.ModelSerializer):
-    report = JSONField(encoder=DjangoJSONEncoder)
+    report = serializers.SerializerMethodField()
 
     class Meta:
         model = Report
         fields = ["report"]
+
+    def get_report(self, obj):
+        rows = obj.rows.order_by("created_at", "id")
+        return ReportRowSerializer(rows, many=True).data
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source="id")
+    # The finished report, at /customer-report/<customer_id>/
+    customer_id = serializers.IntegerField(source="report_id")
+
+    class Meta:
+        model = ReportJob
+        fields = (
+            "job_id",
+            "status",
+            "customer_id",
+            "errors",
+            "attempts",
+            "created_at",
+            "finished_at",
+        )
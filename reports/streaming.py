@@ -0,0 +1,234 @@
+import codecs
+import heapq
+import json
+from typing import Iterable, Iterator, List, Tuple
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.json import strict_constant
+from rest_framework.utils.mediatypes import media_type_matches
+
+from reports.metrics import timed
+from reports.parsers import ORJSONParser
+from reports.renderers import ORJSONRenderer
+from reports.serializers import PAYMENT_SERIALIZERS
+from reports.utils import query_flag
+from reports.validation import ValidatedPayment
+
+CHUNK_SIZE = 64 * 1024
+# Characters which can continue a JSON number
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JSONStreamReader:
+    """
+    Reads JSON values one by one from a binary stream. Only the part of the
+    document which has not been consumed yet is kept in memory.
+    """
+
+    def __init__(self, stream, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder(parse_constant=strict_constant)
+        self.buffer = ""
+        self.pos = 0
+        self.eof = stream is None
+
+    def fill(self) -> bool:
+        """Reads another chunk of the stream, returns False at its end"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        try:
+            decoded = self.utf8.decode(chunk, final=self.eof)
+        except UnicodeDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+        self.buffer = self.buffer[self.pos :] + decoded
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """Next non whitespace character, empty at the end of the stream"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, *chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ParseError(
+                f"JSON parse error - expected {' or '.join(chars)} at {char!r}"
+            )
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as exc:
+                if self.fill():
+                    continue
+                raise ParseError(f"JSON parse error - {exc}")
+            # A number cut by the end of the chunk may have been decoded only in
+            # part, e.g. 12 out of "12." | "5e1", when nothing but the rest of
+            # a number follows it
+            if self.may_continue(value, end) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def may_continue(self, value, end: int) -> bool:
+        return (
+            isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and not self.buffer[end:].strip(NUMBER_CHARS)
+        )
+
+
+class PaymentStream:
+    """
+    Request body of a report parsed incrementally. Payments of the dp, card and
+    pay_by_link arrays are yielded as (payment_type, payment) pairs in document
+    order, one at a time, so the whole JSON tree is never held in memory.
+    Other top level keys are decoded whole and can be read with get/pop once
+    the stream has been consumed.
+    """
+
+    def __init__(self, stream, chunk_size: int = CHUNK_SIZE):
+        self.reader = JSONStreamReader(stream, chunk_size)
+        self.extra = {}
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        for payment_type, payments in self.arrays():
+            for payment in payments:
+                yield payment_type, payment
+
+    def arrays(self) -> Iterator[Tuple[str, Iterator[dict]]]:
+        """
+        (payment_type, payments) of every payment array in document order, each
+        one has to be consumed before moving on to the next. A key may repeat,
+        a fully parsed body keeps only its last array.
+        """
+        reader = self.reader
+        if not reader.peek():
+            # Empty body
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            reader.expect("}")
+            return
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ParseError("JSON parse error - expected an object key")
+            reader.expect(":")
+            if key in PAYMENT_SERIALIZERS:
+                payments = self.iter_payments(key)
+                yield key, payments
+                # Whatever the consumer did not read is skipped
+                for _ in payments:
+                    pass
+            else:
+                self.extra[key] = reader.value()
+            if reader.expect(",", "}") == "}":
+                break
+        if reader.peek():
+            raise ParseError("JSON parse error - extra data after the document")
+
+    def iter_payments(self, payment_type: str) -> Iterator[dict]:
+        reader = self.reader
+        if reader.peek() != "[":
+            # Not an array, handled the same way as in a fully parsed body
+            yield from reader.value() or ()
+            return
+        reader.expect("[")
+        if reader.peek() == "]":
+            reader.expect("]")
+            return
+        while True:
+            yield reader.value()
+            if reader.expect(",", "]") == "]":
+                return
+
+    def get(self, key: str, default=None):
+        return self.extra.get(key, default)
+
+    def pop(self, key: str, default=None):
+        return self.extra.pop(key, default)
+
+
+def streaming_requested(request) -> bool:
+    return query_flag(request, "stream")
+
+
+def streamable(request) -> bool:
+    """Whether the body is UTF-8 JSON, the one ORJSONParser would parse"""
+    encoding = request.encoding or settings.DEFAULT_CHARSET
+    return (
+        media_type_matches(ORJSONParser.media_type, request.content_type)
+        and codecs.lookup(encoding).name == "utf-8"
+    )
+
+
+@timed("parse")
+def get_payments(request):
+    """
+    Request body, parsed incrementally into a PaymentStream when ?stream=1 is
+    passed and fully parsed by DRF otherwise. Bodies of other media types are
+    left to DRF's parsers too, which reject the unsupported ones with 415.
+    """
+    if streaming_requested(request) and streamable(request):
+        return PaymentStream(request.stream)
+    return request.data
+
+
+def in_chronological_order(
+    report: List[ValidatedPayment],
+) -> Iterator[ValidatedPayment]:
+    """
+    Payments ordered by created_at, ties keep the order of the input. The
+    report is validated whole, so it's grouped by type in memory first. Payments
+    of each type usually come already ordered, then the groups are merged on a
+    heap as rows are consumed instead of sorting the whole report.
+    """
+    streams = {payment_type: [] for payment_type in PAYMENT_SERIALIZERS}
+    for position, payment in enumerate(report):
+        streams[payment.serializer.payment_type].append(
+            (payment.validated_data.get("created_at"), position, payment)
+        )
+    if not all(
+        a[0] <= b[0] for stream in streams.values() for a, b in zip(stream, stream[1:])
+    ):
+        streams = {
+            "all": sorted(entry for stream in streams.values() for entry in stream)
+        }
+    return (payment for _, _, payment in heapq.merge(*streams.values()))
+
+
+def render_rows(rows: Iterable[ValidatedPayment]) -> Iterator[bytes]:
+    """Renders rows one by one as chunks of a JSON array"""
+    renderer = ORJSONRenderer()
+    yield b"["
+    for i, row in enumerate(rows):
+        if i:
+            yield b","
+        yield renderer.render(row.data)
+    yield b"]"
+
+
+def stream_report(report: List[ValidatedPayment]) -> StreamingHttpResponse:
+    """
+    Only rendering is streamed: the validated report is held in memory, but
+    its rows are rendered one at a time rather than into a single JSON body.
+    """
+    return StreamingHttpResponse(
+        render_rows(in_chronological_order(report)),
+        content_type="application/json",
+    )
@@ -1,9 +1,18 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path("report/", views.ReportView.as_view()),
+    path("metrics", views.metrics),
     path("customer-report/", views.CustomerReportView.as_view()),
     path("customer-report/<int:customer_id>/", views.CustomerReportView.as_view()),
+    path("customer-report/jobs/", views.ReportJobView.as_view()),
+    path("customer-report/jobs/<int:job_id>/", views.ReportJobView.as_view()),
+    path("async/report/", async_views.AsyncReportView.as_view()),
+    path("async/customer-report/", async_views.AsyncCustomerReportView.as_view()),
+    path(
+        "async/customer-report/<int:customer_id>/",
+        async_views.AsyncCustomerReportView.as_view(),
+    ),
 ]
@@ -1,2 +1,32 @@
+from typing import List, Sequence
+
+from reports.validators import char_matrices
+
+
 def mask_card_number(card_number: str) -> str:
     return card_number[:4] + "*" * len(card_number[4:-4]) + card_number[-4:]
+
+
+def mask_card_numbers(card_numbers: Sequence[str]) -> List[str]:
+    """mask_card_number of many card numbers at once, ASCII ones are masked with numpy"""
+    masked = list(card_numbers)
+    ascii_only = []
+    for i, card_number in enumerate(card_numbers):
+        if card_number.isascii() and len(card_number) > 8:
+            ascii_only.append(i)
+        else:
+            masked[i] = mask_card_number(card_number)
+
+    for group, matrix in char_matrices(card_numbers, ascii_only):
+        matrix = matrix.copy()
+        matrix[:, 4:-4] = ord("*")
+        length = matrix.shape[1]
+        rows = matrix.tobytes().decode("ascii")
+        for i, start in zip(group.tolist(), range(0, len(rows), length)):
+            masked[i] = rows[start : start + length]
+    return masked
+
+
+def query_flag(request, name: str) -> bool:
+    """True for ?name=1 (or true/yes)"""
+    return request.query_params.get(name, "").lower() in ("1", "true", "yes")
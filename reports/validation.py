@@ -0,0 +1,181 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import django
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.settings import api_settings
+
+
+class ValidatedPayment:
+    """Stands in for a validated serializer, `data` is rendered on access"""
+
+    __slots__ = ("serializer", "validated_data")
+
+    def __init__(self, serializer: serializers.Serializer, validated_data: dict):
+        self.serializer = serializer
+        self.validated_data = validated_data
+
+    @property
+    def data(self):
+        return self.serializer.to_representation(self.validated_data)
+
+
+class BatchValidator:
+    """
+    Validates a list of payments of a single type with one serializer instance.
+    Instantiating a ModelSerializer rebuilds all of its fields (and their
+    validators) from the model, doing it once per batch instead of once per
+    row is what makes this fast. Errors and validated data are exactly the
+    ones `serializer_class(data=item).is_valid()` would produce.
+    """
+
+    def __init__(self, serializer_class: Type[serializers.Serializer]):
+        self.serializer = serializer_class()
+        # Builds the fields, they are cached on the instance from now on
+        self.serializer.fields
+
+    def validate(self, items: Iterable) -> Tuple[List[ValidatedPayment], List[dict]]:
+        validated, errors = [], []
+        items = list(items)
+        with self.serializer.batch(items):
+            for item in items:
+                payment, error = self.validate_item(item)
+                if error is None:
+                    validated.append(payment)
+                else:
+                    errors.append(error)
+        return validated, errors
+
+    def validate_item(self, item) -> Tuple[Optional[ValidatedPayment], Optional[dict]]:
+        try:
+            validated_data = self.serializer.run_validation(item)
+        except ValidationError as exc:
+            return None, self.format_errors(exc.detail)
+        return ValidatedPayment(self.serializer, validated_data), None
+
+    @staticmethod
+    def format_errors(detail):
+        """Same as Serializer.errors"""
+        if (
+            isinstance(detail, list)
+            and len(detail) == 1
+            and getattr(detail[0], "code", None) == "null"
+        ):
+            detail = {
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    ErrorDetail("No data provided", code="null")
+                ]
+            }
+        return detail
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """
+    Pool of REPORT_VALIDATION_PROCESSES processes, started on first use and
+    kept for the lifetime of this one. Processes are spawned rather than
+    forked, the parent may already run threads (e.g. fetching rates).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                settings.REPORT_VALIDATION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def shutdown_process_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Shuts down a broken pool, unless another thread already replaced it"""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    pool.shutdown()
+
+
+def validate_chunk(
+    serializer_class: Type[serializers.Serializer], items: list
+) -> Tuple[List[dict], List[dict]]:
+    """BatchValidator.validate in a pool process, only plain data is sent back"""
+    validated, errors = BatchValidator(serializer_class).validate(items)
+    return [payment.validated_data for payment in validated], errors
+
+
+def submit_chunk(
+    pool: ProcessPoolExecutor, serializer_class: Type[serializers.Serializer], chunk
+) -> Future:
+    try:
+        return pool.submit(validate_chunk, serializer_class, chunk)
+    except BrokenProcessPool:
+        raise
+    except RuntimeError as e:
+        # Another thread shut the broken pool down meanwhile
+        raise BrokenProcessPool(str(e)) from e
+
+
+def validate_in_processes(
+    validators: Dict[str, BatchValidator], payments: Dict[str, list]
+) -> Tuple[List[ValidatedPayment], List[dict]]:
+    """
+    Validates payments of every type in chunks of REPORT_VALIDATION_CHUNK_SIZE
+    spread over the process pool. Partial results are put together in the
+    order of the chunks, so payments and errors come in exactly the order
+    of validating them one validator after another.
+    """
+    size = settings.REPORT_VALIDATION_CHUNK_SIZE
+    pool = process_pool()
+    try:
+        futures = [
+            (validator, submit_chunk(pool, type(validator.serializer), chunk))
+            for payment_type, validator in validators.items()
+            for items in [list(payments.get(payment_type) or [])]
+            for chunk in (items[i : i + size] for i in range(0, len(items), size))
+        ]
+        results = [(validator, future.result()) for validator, future in futures]
+    except BrokenProcessPool as e:
+        # A pool process died (e.g. killed for its memory), the next call starts a new pool
+        logging.exception(e)
+        discard_process_pool(pool)
+        return validate_serially(validators, payments)
+
+    report, errors = [], []
+    for validator, (validated, invalid) in results:
+        report.extend(
+            ValidatedPayment(validator.serializer, validated_data)
+            for validated_data in validated
+        )
+        errors.extend(invalid)
+    return report, errors
+
+
+def validate_serially(
+    validators: Dict[str, BatchValidator], payments: Dict[str, list]
+) -> Tuple[List[ValidatedPayment], List[dict]]:
+    report, errors = [], []
+    for payment_type, validator in validators.items():
+        if items := payments.get(payment_type):
+            validated, invalid = validator.validate(items)
+            report.extend(validated)
+            errors.extend(invalid)
+    return report, errors
@@ -1,4 +1,29 @@
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
 from django.core.exceptions import ValidationError
+from localflavor.generic.validators import NORDEA_COUNTRY_CODE_LENGTH, IBANValidator
+from stdnum import numdb
+from stdnum.exceptions import ValidationError as StdnumValidationError
+from stdnum.util import get_cc_module
+
+# Luhn's doubling of a digit, with the digits of the result summed up
+DOUBLED_DIGITS = np.array([0, 2, 4, 6, 8, 1, 3, 5, 7, 9])
+
+# Results of check_cards for the batch being validated, see prechecked_cards
+checked_cards: ContextVar[Optional[Dict[str, bool]]] = ContextVar(
+    "checked_cards", default=None
+)
+# Validator and its results for the batch being validated, see
+# BatchIBANValidator.prechecked
+checked_ibans: ContextVar[Optional[tuple]] = ContextVar("checked_ibans", default=None)
+
+# Parts of a BBAN structure in the IBAN registry, e.g. "8!n10!n"
+bban_part_re = re.compile(r"([1-9][0-9]*)!([nac])")
+BBAN_CHARS = {"n": "[0-9]", "a": "[A-Z]", "c": "[A-Za-z0-9]"}
 
 
 def check_card(card_number: str) -> bool:
@@ -14,6 +39,223 @@ def check_card(card_number: str) -> bool:
     return (total * 9) % 10 == checksum
 
 
+def char_matrices(
+    strings: Sequence[str], indices: Sequence[int]
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Groups ASCII strings (given by their indices) by length, yields the indices
+    of every group and a matrix of its characters, one string per row.
+    """
+    if isinstance(indices, range):
+        indices = np.arange(indices.start, indices.stop, dtype=np.intp)
+        lengths = np.fromiter(map(len, strings), np.intp, len(strings))
+    else:
+        indices = np.asarray(indices, dtype=np.intp)
+        lengths = np.fromiter(map(len, map(strings.__getitem__, indices)), np.intp)
+    if not len(indices):
+        return
+    order = np.argsort(lengths, kind="stable")
+    indices, lengths = indices[order], lengths[order]
+    bounds = np.flatnonzero(np.diff(lengths)) + 1
+    for group in np.split(indices, bounds):
+        length = len(strings[group[0]])
+        joined = "".join(map(strings.__getitem__, group.tolist())).encode("ascii")
+        matrix = np.frombuffer(joined, dtype=np.uint8).reshape(len(group), length)
+        yield group, matrix
+
+
+def plain_digits(card_numbers: Sequence[str]) -> Sequence[int]:
+    """Indices of the card numbers which consist of ASCII digits only"""
+    joined = "".join(card_numbers)
+    if joined.isascii() and joined.isdigit() and all(card_numbers):
+        return range(len(card_numbers))
+    return [i for i, n in enumerate(card_numbers) if n.isascii() and n.isdigit()]
+
+
+def check_cards(card_numbers: Sequence[str]) -> np.ndarray:
+    """
+    check_card of many card numbers at once. Plain digit strings are checked
+    with numpy, a matrix per length, anything else by check_card itself.
+    """
+    valid = np.zeros(len(card_numbers), dtype=bool)
+    digits_only = plain_digits(card_numbers)
+    if len(digits_only) < len(card_numbers):
+        for i in set(range(len(card_numbers))).difference(digits_only):
+            valid[i] = check_card(card_numbers[i])
+
+    for group, matrix in char_matrices(card_numbers, digits_only):
+        digits = matrix - ord("0")
+        length = matrix.shape[1]
+        # Counting from the check digit, every second one is doubled
+        kept = np.arange(length - 1, -1, -2)
+        doubled = np.arange(length - 2, -1, -2)
+        total = digits[:, kept].sum(axis=1) + DOUBLED_DIGITS[digits[:, doubled]].sum(
+            axis=1
+        )
+        valid[group] = total % 10 == 0
+    return valid
+
+
+@contextmanager
+def prechecked_cards(card_numbers: Sequence[str]):
+    """Lets card_validator look up the numbers instead of checking them one by one"""
+    card_numbers = [card_numbers[i] for i in plain_digits(card_numbers)]
+    token = checked_cards.set(
+        dict(zip(card_numbers, check_cards(card_numbers).tolist()))
+    )
+    try:
+        yield
+    finally:
+        checked_cards.reset(token)
+
+
 def card_validator(card_number: str) -> None:
-    if not check_card(card_number):
+    checked = checked_cards.get()
+    valid = checked.get(card_number) if checked is not None else None
+    if valid is None:
+        valid = check_card(card_number)
+    if not valid:
         raise ValidationError("Malformed card number")
+
+
+def bban_pattern(structure: str) -> re.Pattern:
+    """The regular expression python-stdnum checks a BBAN of that structure with"""
+    return re.compile(
+        "^%s$"
+        % bban_part_re.sub(
+            lambda match: "%s{%s}" % (BBAN_CHARS[match.group(2)], match.group(1)),
+            structure,
+        )
+    )
+
+
+class BatchIBANValidator(IBANValidator):
+    """
+    IBANValidator which can check a whole batch of IBANs at once. Lengths,
+    BBAN formats and national checks are looked up per country up front and
+    mod-97 runs on numpy matrices, a column at a time over all IBANs of the
+    same length. IBANs which do not pass are validated again one by one to
+    get exactly the error IBANValidator raises.
+    """
+
+    def __init__(self, use_nordea_extensions=False, include_countries=None):
+        super().__init__(use_nordea_extensions, include_countries)
+        registry = numdb.get("iban")
+        # Country code: (length, BBAN pattern, national module)
+        self.formats = {}
+        for country_code, length in self.validation_countries.items():
+            if include_countries and country_code not in include_countries:
+                continue
+            if country_code in NORDEA_COUNTRY_CODE_LENGTH:
+                # Not in the registry and not checked by python-stdnum
+                self.formats[country_code] = (length, None, None)
+                continue
+            properties = registry.info(country_code)[0][1]
+            if not properties:
+                continue
+            self.formats[country_code] = (
+                length,
+                bban_pattern(properties.get("bban", "")),
+                get_cc_module(country_code.lower(), "iban"),
+            )
+
+    def __deepcopy__(self, memo):
+        # Serializers copy their fields' arguments, the results of a batch are
+        # kept for this very instance though. It holds no state of its own.
+        return self
+
+    @staticmethod
+    def normalize(value: str) -> str:
+        return value.upper().replace(" ", "").replace("-", "")
+
+    def check(self, values: Sequence[str]) -> List[Optional[ValidationError]]:
+        """The error IBANValidator would raise for every value, None if valid"""
+        normalized = [self.normalize(value) for value in values]
+        candidates = []
+        for i, value in enumerate(normalized):
+            iban_format = self.formats.get(value[:2])
+            if (
+                iban_format is not None
+                and iban_format[0] == len(value)
+                and value.isascii()
+                and value.isalnum()
+            ):
+                candidates.append(i)
+        valid = np.zeros(len(values), dtype=bool)
+        for group, matrix in char_matrices(normalized, candidates):
+            valid[group] = self.checksums_match(matrix)
+
+        errors = []
+        for value, iban, checksum_valid in zip(values, normalized, valid.tolist()):
+            if checksum_valid and self.bban_valid(iban):
+                errors.append(None)
+            else:
+                errors.append(self.error(value))
+        return errors
+
+    @staticmethod
+    def checksums_match(matrix: np.ndarray) -> np.ndarray:
+        """
+        Check digits of uppercase alphanumeric IBANs of the same length, which
+        IBANValidator.iban_checksum calculates with a big integer.
+        """
+        codes = matrix.astype(np.int64)
+        check_digits_given = (codes[:, 2:4] <= ord("9")).all(axis=1)
+        check_digits = (codes[:, 2] - ord("0")) * 10 + codes[:, 3] - ord("0")
+        # Country code moved to the end, letters stand for two digits (A = 10)
+        rearranged = np.concatenate([codes[:, 4:], codes[:, :2]], axis=1)
+        is_digit = rearranged <= ord("9")
+        numbers = np.where(is_digit, rearranged - ord("0"), rearranged - ord("A") + 10)
+        scales = np.where(is_digit, 10, 100)
+        remainders = np.zeros(len(codes), dtype=np.int64)
+        for column in range(rearranged.shape[1]):
+            remainders = (remainders * scales[:, column] + numbers[:, column]) % 97
+        # Followed by "00" in place of the check digits
+        remainders = remainders * 100 % 97
+        return check_digits_given & (98 - remainders == check_digits)
+
+    def bban_valid(self, iban: str) -> bool:
+        """python-stdnum's part of the validation, for an IBAN with valid check digits"""
+        _, pattern, module = self.formats[iban[:2]]
+        if pattern is None:
+            return True
+        if not pattern.match(iban[4:]):
+            return False
+        if module is not None:
+            try:
+                module.validate(iban)
+            except StdnumValidationError:
+                return False
+        return True
+
+    def error(self, value: str) -> Optional[ValidationError]:
+        try:
+            super().__call__(value)
+        except ValidationError as exc:
+            return exc
+        return None
+
+    @contextmanager
+    def prechecked(self, values: Sequence[str]):
+        """Lets the validator look up the values instead of checking them one by one"""
+        token = checked_ibans.set((self, dict(zip(values, self.check(values)))))
+        try:
+            yield
+        finally:
+            checked_ibans.reset(token)
+
+    def __call__(self, value):
+        prechecked = checked_ibans.get()
+        if (
+            prechecked is None
+            or prechecked[0] is not self
+            or value not in prechecked[1]
+        ):
+            return super().__call__(value)
+        error = prechecked[1][value]
+        if error is not None:
+            raise error
+
+
+# Same as the one IBANField of DirectPayment validates with
+iban_validator = BatchIBANValidator()
@@ -1,92 +1,312 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from reports.models import Report
+from reports.caching import (
+    etag_matches,
+    get_rendered,
+    get_report_version,
+    report_etag,
+    set_rendered,
+)
+from reports.encoding import IDENTITY, compress, encoded_response
+from reports.ingest import delete_payments, save_payments
+from reports.integration import prefetch_exchange_rates
+from reports.metrics import CONTENT_TYPE, registry, timed
+from reports.models import Report, ReportJob, ReportRow
+from reports.pagination import (
+    CustomerReportPagination,
+    ReportPagination,
+    filter_by_date,
+    filter_report_rows,
+)
+from reports.renderers import ORJSONRenderer
+from reports.streaming import (
+    PaymentStream,
+    get_payments,
+    in_chronological_order,
+    stream_report,
+    streaming_requested,
+)
+from reports.utils import query_flag
+from reports.validation import (
+    BatchValidator,
+    validate_in_processes,
+    validate_serially,
+)
 
 from .serializers import (
-    ByLinkPaymentSerializer,
-    CardPaymentSerializer,
-    DirectPaymentSerializer,
-    ReportSerializer,
+    PAYMENT_SERIALIZERS,
+    ReportJobSerializer,
+    ReportRowSerializer,
+)
+
+BATCH_SIZE = 1000
+# Query parameters which select a part of a stored report
+REPORT_QUERY_PARAMS = (
+    "date_from",
+    "date_to",
+    "type",
+    "currency",
+    "cursor",
+    "page_size",
+)
+# Rendered report fields stored in ReportRow columns of the same name
+REPORT_ROW_FIELDS = (
+    "type",
+    "payment_mean",
+    "description",
+    "currency",
+    "amount",
+    "amount_in_pln",
 )
 
 
+@timed("validate")
 def generate_report(data):
-    report, errors = [], []
-    if direct_payments := data.get("dp"):
-        for direct_payment in direct_payments:
-            serializer = DirectPaymentSerializer(data=direct_payment)
-            if serializer.is_valid():
-                report.append(serializer)
-            else:
-                errors.append(serializer.errors)
-    if card_payments := data.get("card"):
-        for card_payment in card_payments:
-            serializer = CardPaymentSerializer(data=card_payment)
-            if serializer.is_valid():
-                report.append(serializer)
-            else:
-                errors.append(serializer.errors)
-    if by_link_payments := data.get("pay_by_link"):
-        for by_link_payment in by_link_payments:
-            serializer = ByLinkPaymentSerializer(data=by_link_payment)
-            if serializer.is_valid():
-                report.append(serializer)
-            else:
-                errors.append(serializer.errors)
-    return report, errors
+    """
+    Validates all payments of a request body, either a parsed dict or a PaymentStream.
+    Returns validated payments and errors, both grouped by payment type in the
+    order of PAYMENT_SERIALIZERS and in the order of the input within a type.
+    """
+    validators = {
+        payment_type: BatchValidator(serializer_class)
+        for payment_type, serializer_class in PAYMENT_SERIALIZERS.items()
+    }
+    if isinstance(data, PaymentStream):
+        results = {}
+        for payment_type, payments in data.arrays():
+            # A repeated key replaces the earlier array, just like in a parsed body
+            results[payment_type] = report, errors = [], []
+            for payment in payments:
+                validated, error = validators[payment_type].validate_item(payment)
+                if error is None:
+                    report.append(validated)
+                else:
+                    errors.append(error)
+        # Grouped by type in the order of validate_serially
+        report, errors = [], []
+        for payment_type in validators:
+            validated, invalid = results.get(payment_type, ((), ()))
+            report.extend(validated)
+            errors.extend(invalid)
+        return report, errors
+
+    payments = {payment_type: data.get(payment_type) for payment_type in validators}
+    if settings.REPORT_VALIDATION_PROCESSES and (
+        sum(len(items) for items in payments.values() if isinstance(items, list))
+        > settings.REPORT_VALIDATION_CHUNK_SIZE
+    ):
+        return validate_in_processes(validators, payments)
+    return validate_serially(validators, payments)
+
+
+def rate_pairs(report):
+    return [
+        (payment.validated_data["currency"], payment.validated_data["created_at"])
+        for payment in report
+    ]
+
+
+@timed("rates")
+def prefetch_rates(report):
+    """Resolves exchange rates for the whole report before it gets serialized"""
+    prefetch_exchange_rates(rate_pairs(report))
+
+
+@timed("serialize")
+def render_report(report):
+    return [payment.data for payment in in_chronological_order(report)]
+
+
+def render_stored(rows):
+    """Rendered report and its encoding as kept in the database"""
+    encoding = settings.CUSTOMER_REPORT_STORAGE
+    if not encoding:
+        return None, IDENTITY
+    if encoding == "identity":
+        encoding = IDENTITY
+    content = ORJSONRenderer().render(ReportRowSerializer(rows, many=True).data)
+    return compress(content, encoding), encoding
+
+
+@timed("db")
+def save_report(customer_id, report, append=False, payments=()):
+    """
+    Creates a report or overwrites rows of an existing customer's one.
+    When appending, existing rows are kept and only the new ones are inserted,
+    reading rows ordered by (created_at, id) merges them chronologically.
+    Validated `payments` of the report are saved too when PERSIST_PAYMENTS is on.
+    """
+    with transaction.atomic():
+        try:
+            instance = Report.objects.select_for_update().get(id=customer_id)
+            if not append:
+                instance.rows.all().delete()
+                delete_payments(instance)
+            instance.version += 1
+        except Report.DoesNotExist:
+            instance = Report.objects.create()
+        if settings.PERSIST_PAYMENTS:
+            save_payments(payments, instance)
+        rows = [
+            ReportRow(
+                report=instance,
+                created_at=row["date"],
+                **{field: row[field] for field in REPORT_ROW_FIELDS},
+            )
+            for row in report
+        ]
+        ReportRow.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        if append:
+            # Rendered again on the next read of the whole report
+            instance.rendered, instance.rendered_encoding = None, IDENTITY
+        else:
+            instance.rendered, instance.rendered_encoding = render_stored(rows)
+        instance.save(update_fields=["version", "rendered", "rendered_encoding"])
+    return instance
 
 
 class ReportView(APIView):
+    pagination_class = ReportPagination
+
     def post(self, request: Request):
-        data = request.data
+        data = get_payments(request)
 
         report, errors = generate_report(data)
         if errors:
             return Response(errors, status=400)
 
-        report = sorted(
-            report, key=lambda payment: payment.validated_data.get("created_at")
-        )
-        report = [serializer.data for serializer in report]
-        return Response(report, status=200)
+        report = filter_by_date(report, request)
+        paginator = self.pagination_class()
+        if paginator.is_requested(request):
+            # Only rows of the page are converted, so only their rates are needed
+            page = paginator.paginate_queryset(report, request, view=self)
+            prefetch_rates(page)
+            return paginator.get_paginated_response([p.data for p in page])
+
+        prefetch_rates(report)
+        if streaming_requested(request):
+            return stream_report(report)
+        return Response(render_report(report), status=200)
 
 
 class CustomerReportView(APIView):
+    pagination_class = CustomerReportPagination
+
     def post(self, request: Request):
-        data = request.data
-        customer_id = data.pop("customer_id", None)
+        data = get_payments(request)
 
         report, errors = generate_report(data)
+        # A streamed body is read while generating the report
+        customer_id = data.pop("customer_id", None)
         if errors:
             return Response(errors, status=400)
 
-        report = sorted(
-            report, key=lambda payment: payment.validated_data.get("created_at")
+        prefetch_rates(report)
+        customer_report = save_report(
+            customer_id,
+            render_report(report),
+            append=query_flag(request, "append"),
+            payments=report,
         )
-        report = [serializer.data for serializer in report]
-
-        try:
-            instance = Report.objects.get(id=customer_id)
-        except Report.DoesNotExist:
-            instance = None
-
-        report_serializer = ReportSerializer(instance, data={"report": report})
-        if report_serializer.is_valid():
-            customer_report = report_serializer.save()
-        else:
-            return Response(report_serializer.errors, status=400)
-
         return Response({"customer_id": customer_report.id}, status=201)
 
     def get(self, request: Request, customer_id=None):
         if not customer_id:
             return Response("Not found", status=404)
 
+        version = get_report_version(customer_id)
+        if version is None:
+            return Response("Not found", status=404)
+
+        etag = report_etag(customer_id, version, request)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        if request.accepted_renderer.format != "json":
+            # e.g. the browsable api, only JSON is worth caching
+            return self.get_report(request, customer_id)
+
+        rendered = get_rendered(customer_id, version, request)
+        if rendered is None:
+            rendered = self.render_report(request, customer_id, version)
+            set_rendered(customer_id, version, request, rendered)
+        response = encoded_response(request, *rendered)
+        response["ETag"] = etag
+        return response
+
+    def render_report(self, request: Request, customer_id, version):
+        """Final JSON of the requested report and its content encoding"""
+        whole_report = not any(
+            param in request.query_params for param in REPORT_QUERY_PARAMS
+        )
+        if not (settings.CUSTOMER_REPORT_STORAGE and whole_report):
+            content = ORJSONRenderer().render(
+                self.get_report(request, customer_id).data
+            )
+            return content, IDENTITY
+
+        report = Report.objects.only("rendered", "rendered_encoding").get(
+            id=customer_id
+        )
+        if report.rendered is not None:
+            return bytes(report.rendered), report.rendered_encoding
+        rows = ReportRow.objects.filter(report_id=customer_id).order_by(
+            *self.pagination_class.ordering
+        )
+        rendered, encoding = render_stored(rows)
+        # Unless the report changed in the meantime
+        Report.objects.filter(id=customer_id, version=version).update(
+            rendered=rendered, rendered_encoding=encoding
+        )
+        return rendered, encoding
+
+    def get_report(self, request: Request, customer_id) -> Response:
+        rows = filter_report_rows(
+            ReportRow.objects.filter(report_id=customer_id), request
+        )
+        paginator = self.pagination_class()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(rows, request, view=self)
+            data = ReportRowSerializer(page, many=True).data
+            return paginator.get_paginated_response(data)
+
+        rows = rows.order_by(*paginator.ordering)
+        return Response(ReportRowSerializer(rows, many=True).data, status=200)
+
+
+class ReportJobView(APIView):
+    """
+    Customer reports too large to be built within a request. The body is the
+    same as of POST /customer-report/, it's queued as it is and the report is
+    built by a worker (see run_report_workers command) while the client polls.
+    """
+
+    def post(self, request: Request):
+        if not request.content_type.startswith("application/json"):
+            raise UnsupportedMediaType(request.content_type)
+        job = ReportJob.objects.create(
+            payload=request.body, append=query_flag(request, "append")
+        )
+        response = Response(ReportJobSerializer(job).data, status=202)
+        response["Location"] = f"/customer-report/jobs/{job.id}/"
+        return response
+
+    def get(self, request: Request, job_id):
         try:
-            report = Report.objects.get(id=customer_id)
-        except Report.DoesNotExist:
+            job = ReportJob.objects.defer("payload").get(id=job_id)
+        except ReportJob.DoesNotExist:
             return Response("Not found", status=404)
+        return Response(ReportJobSerializer(job).data, status=200)
+
 
-        return Response(report.report, status=200)
+def metrics(request):
+    """Request timings (and other metrics) of this process for Prometheus"""
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
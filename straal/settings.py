@@ -45,7 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "reports.middleware.TimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "reports.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -126,7 +128,95 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 
+# Exchange rates
+
+NBP_API_URL = os.environ.get("NBP_API_URL", "http://api.nbp.pl")
+# In seconds
+NBP_API_CONNECT_TIMEOUT = float(os.environ.get("NBP_API_CONNECT_TIMEOUT", 3.05))
+NBP_API_READ_TIMEOUT = float(os.environ.get("NBP_API_READ_TIMEOUT", 10))
+NBP_API_RETRIES = int(os.environ.get("NBP_API_RETRIES", 3))
+NBP_API_POOL_SIZE = int(os.environ.get("NBP_API_POOL_SIZE", 10))
+# Consecutive failures after which calls to the API are rejected for a while
+NBP_API_CIRCUIT_THRESHOLD = int(os.environ.get("NBP_API_CIRCUIT_THRESHOLD", 5))
+NBP_API_CIRCUIT_RESET_TIMEOUT = float(
+    os.environ.get("NBP_API_CIRCUIT_RESET_TIMEOUT", 30)
+)
+
+EXCHANGE_RATE_CACHE_SIZE = int(os.environ.get("EXCHANGE_RATE_CACHE_SIZE", 4096))
+# In seconds
+EXCHANGE_RATE_CACHE_TTL = int(os.environ.get("EXCHANGE_RATE_CACHE_TTL", 24 * 60 * 60))
+# Threads resolving missing rates of a single report concurrently
+EXCHANGE_RATE_WORKERS = int(os.environ.get("EXCHANGE_RATE_WORKERS", 8))
+# Read rates only from the ExchangeRate table (see load_exchange_rates command)
+EXCHANGE_RATES_OFFLINE = bool(os.environ.get("EXCHANGE_RATES_OFFLINE", False))
+# In seconds, rates missing from the table are looked up again after that long
+EXCHANGE_RATE_MISSING_TTL = int(os.environ.get("EXCHANGE_RATE_MISSING_TTL", 60))
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+# Rendered customer reports are cached under their version, which is read from
+# the database, so every process sees updates. A shared cache (CACHE_URL, needs
+# redis) keeps a single copy of each rendering instead of one per process
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.environ.get("CACHE_URL", False):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["CACHE_URL"],
+    }
+# In seconds
+CUSTOMER_REPORT_CACHE_TIMEOUT = int(
+    os.environ.get("CUSTOMER_REPORT_CACHE_TIMEOUT", 5 * 60)
+)
+
+# Keep rendered JSON of customer reports next to their rows, so it can be served
+# as it is. Either empty (disabled), "identity", "gzip" or "zstd" (needs zstandard)
+CUSTOMER_REPORT_STORAGE = os.environ.get("CUSTOMER_REPORT_STORAGE", "")
+
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
+    "DEFAULT_RENDERER_CLASSES": [
+        "reports.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "reports.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
+
+# Durations of request phases in a Server-Timing header, they are collected
+# for /metrics either way
+SERVER_TIMING = bool(int(os.environ.get("SERVER_TIMING", 1)))
+
+# Responses of at least that many bytes are compressed, when the client accepts it
+RESPONSE_COMPRESSION_MIN_SIZE = int(
+    os.environ.get("RESPONSE_COMPRESSION_MIN_SIZE", 1024)
+)
+
+# Customer reports submitted to /customer-report/jobs/ are built by
+# `python manage.py run_report_workers`, each process builds that many at a time
+REPORT_JOB_WORKERS = int(os.environ.get("REPORT_JOB_WORKERS", 4))
+# In seconds
+REPORT_JOB_POLL_INTERVAL = float(os.environ.get("REPORT_JOB_POLL_INTERVAL", 1))
+# A running job is given up by its worker (it crashed) when the lease isn't renewed
+REPORT_JOB_LEASE = int(os.environ.get("REPORT_JOB_LEASE", 60))
+REPORT_JOB_MAX_ATTEMPTS = int(os.environ.get("REPORT_JOB_MAX_ATTEMPTS", 3))
+
+# Payments of requests with more than REPORT_VALIDATION_CHUNK_SIZE of them are
+# validated in chunks by a pool of that many processes, 0 validates them in the
+# process handling the request
+REPORT_VALIDATION_PROCESSES = int(os.environ.get("REPORT_VALIDATION_PROCESSES", 0))
+REPORT_VALIDATION_CHUNK_SIZE = int(
+    os.environ.get("REPORT_VALIDATION_CHUNK_SIZE", 10000)
+)
+
+# Save the validated payments of customer reports in the Card, DirectPayment and
+# PayByLink tables, next to the report's rows
+PERSIST_PAYMENTS = bool(int(os.environ.get("PERSIST_PAYMENTS", 0)))
@@ -0,0 +1,255 @@
+import asyncio
+import datetime
+import json
+import time
+
+import httpx
+import pytest
+import requests
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import AsyncClient
+
+from reports.integration import async_nbp_client, rate_cache
+from reports.models import Report
+from reports.serializers import ReportSerializer
+
+EXCHANGE_RATE = 2
+
+PAY_BY_LINK = {
+    "created_at": "2021-05-13T01:01:43-08:00",
+    "currency": "EUR",
+    "amount": 3001,
+    "description": "Abonament na siłownię",
+    "bank": "mbank",
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Rendered reports are cached by id and ids are reused between tests
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def nbp_requests(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.2)
+        start = request.url.path.rstrip("/").split("/")[-2]
+        return httpx.Response(
+            200, json={"rates": [{"effectiveDate": start, "mid": EXCHANGE_RATE}]}
+        )
+
+    monkeypatch.setattr(async_nbp_client, "transport", httpx.MockTransport(handler))
+    monkeypatch.setattr(async_nbp_client, "_clients", {})
+    rate_cache.invalidate()
+    yield calls
+    rate_cache.invalidate()
+
+
+def test_async_report_view_returns_report():
+    response = async_to_sync(AsyncClient().post)(
+        "/async/report/",
+        {"pay_by_link": [PAY_BY_LINK]},
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "date": "2021-05-13T09:01:43Z",
+            "type": "pay_by_link",
+            "payment_mean": "mbank",
+            "description": "Abonament na siłownię",
+            "currency": "EUR",
+            "amount": 3001,
+            "amount_in_pln": 3001 * EXCHANGE_RATE,
+        }
+    ]
+
+
+def test_async_report_view_returns_errors():
+    response = async_to_sync(AsyncClient().post)(
+        "/async/report/",
+        {"pay_by_link": [{**PAY_BY_LINK, "currency": "ABC"}]},
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert response.json() == [{"currency": ['"ABC" is not a valid choice.']}]
+
+
+def test_async_report_view_rejects_malformed_json():
+    response = async_to_sync(AsyncClient().post)(
+        "/async/report/", "{", content_type="application/json"
+    )
+    assert response.status_code == 400
+
+
+def test_async_report_view_serves_concurrent_requests_in_one_thread(nbp_requests):
+    async def post_many():
+        client = AsyncClient()
+        return await asyncio.gather(
+            *(
+                client.post(
+                    "/async/report/",
+                    {"pay_by_link": [PAY_BY_LINK]},
+                    content_type="application/json",
+                )
+                for _ in range(50)
+            )
+        )
+
+    started = time.monotonic()
+    responses = async_to_sync(post_many)()
+
+    assert time.monotonic() - started < 5
+    assert all(response.status_code == 200 for response in responses)
+    # Identical lookups in flight at the same time share a single request
+    assert len(nbp_requests) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_customer_report_is_saved_and_read():
+    client = AsyncClient()
+    response = async_to_sync(client.post)(
+        "/async/customer-report/",
+        {"pay_by_link": [PAY_BY_LINK]},
+        content_type="application/json",
+    )
+    assert response.status_code == 201
+    customer_id = response.json()["customer_id"]
+
+    response = async_to_sync(client.get)(f"/async/customer-report/{customer_id}/")
+    assert response.status_code == 200
+    report = Report.objects.get(id=customer_id)
+    assert response.json() == ReportSerializer(report).data["report"]
+    assert response.json()[0]["amount_in_pln"] == 3001 * EXCHANGE_RATE
+
+    response = async_to_sync(client.get)("/async/customer-report/999/")
+    assert response.status_code == 404
+
+
+def test_async_report_view_filters_and_paginates():
+    payments = [
+        {**PAY_BY_LINK, "created_at": f"2021-05-{day}T10:00:00Z"}
+        for day in (13, 11, 12, 14)
+    ]
+    client = AsyncClient()
+    response = async_to_sync(client.post)(
+        "/async/report/?date_from=2021-05-12&limit=2",
+        {"pay_by_link": payments},
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    assert response.json()["count"] == 3
+    assert [row["date"] for row in response.json()["results"]] == [
+        "2021-05-12T10:00:00Z",
+        "2021-05-13T10:00:00Z",
+    ]
+
+    response = async_to_sync(client.post)(
+        "/async/report/?date_from=tomorrow",
+        {"pay_by_link": payments},
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert "date_from" in response.json()
+
+
+def test_async_report_view_streams_report():
+    async def post():
+        response = await AsyncClient().post(
+            "/async/report/?stream=1",
+            {"pay_by_link": [PAY_BY_LINK, PAY_BY_LINK]},
+            content_type="application/json",
+        )
+        return response, b"".join([chunk async for chunk in response])
+
+    response, content = async_to_sync(post)()
+    assert response.status_code == 200
+    assert response.streaming
+    assert [row["amount"] for row in json.loads(content)] == [3001, 3001]
+
+
+def test_async_report_view_streams_rows_off_the_event_loop(monkeypatch):
+    today = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    blocking_calls = []
+
+    class MockResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {"rates": [{"effectiveDate": str(today.date()), "mid": 3}]}
+
+    def mock_get(session, url, *args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            blocking_calls.append(url)
+        return MockResponse()
+
+    async def handler(request):
+        # Today's table is not published yet, so the rate is looked up later
+        return httpx.Response(200, json={"rates": []})
+
+    monkeypatch.setattr(async_nbp_client, "transport", httpx.MockTransport(handler))
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+
+    async def post():
+        response = await AsyncClient().post(
+            "/async/report/?stream=1",
+            {"pay_by_link": [{**PAY_BY_LINK, "created_at": today.isoformat()}]},
+            content_type="application/json",
+        )
+        return b"".join([chunk async for chunk in response])
+
+    content = async_to_sync(post)()
+
+    assert json.loads(content)[0]["amount_in_pln"] == 3001 * 3
+    assert blocking_calls == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_customer_report_is_appended_to():
+    client = AsyncClient()
+    customer_id = async_to_sync(client.post)(
+        "/async/customer-report/",
+        {"pay_by_link": [PAY_BY_LINK]},
+        content_type="application/json",
+    ).json()["customer_id"]
+
+    async_to_sync(client.post)(
+        "/async/customer-report/?append=1",
+        {"customer_id": customer_id, "pay_by_link": [PAY_BY_LINK]},
+        content_type="application/json",
+    )
+
+    assert Report.objects.get(id=customer_id).rows.count() == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_customer_report_is_read_like_the_sync_one():
+    client = AsyncClient()
+    customer_id = async_to_sync(client.post)(
+        "/async/customer-report/",
+        {"pay_by_link": [PAY_BY_LINK]},
+        content_type="application/json",
+    ).json()["customer_id"]
+    url = f"/async/customer-report/{customer_id}/"
+
+    response = async_to_sync(client.get)(url)
+    assert response.status_code == 200
+    response = async_to_sync(client.get)(
+        url, headers={"If-None-Match": response["ETag"]}
+    )
+    assert response.status_code == 304
+
+    response = async_to_sync(client.get)(f"{url}?currency=PLN")
+    assert response.json() == []
+    response = async_to_sync(client.get)(f"{url}?page_size=1")
+    assert len(response.json()["results"]) == 1
@@ -0,0 +1,82 @@
+import datetime
+import json
+
+import pytest
+import requests
+from django.core.management import call_command
+
+from reports.integration import get_exchange_rate, prefetch_exchange_rates, rate_cache
+from reports.management.commands.load_exchange_rates import date_windows
+from reports.models import ExchangeRate
+
+
+@pytest.fixture(autouse=True)
+def offline(settings, monkeypatch):
+    def mock_get(session, url, *args, **kwargs):
+        raise AssertionError(f"Unexpected request to {url}")
+
+    settings.EXCHANGE_RATES_OFFLINE = True
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    rate_cache.invalidate()
+    yield
+    rate_cache.invalidate()
+
+
+def test_date_windows_cover_range_without_overlap():
+    start, end = datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)
+    windows = list(date_windows(start, end))
+    assert windows[0][0] == start and windows[-1][1] == end
+    assert all((b - a).days < 93 for a, b in windows)
+    assert all(
+        prev[1] + datetime.timedelta(days=1) == nxt[0]
+        for prev, nxt in zip(windows, windows[1:])
+    )
+
+
+@pytest.mark.django_db
+def test_load_exchange_rates_from_csv_and_json(tmp_path):
+    csv_dump = tmp_path / "rates.csv"
+    csv_dump.write_text("currency,date,mid\nEUR,2021-05-13,4.5\nUSD,2021-05-13,3.7\n")
+    json_dump = tmp_path / "rates.json"
+    json_dump.write_text(
+        json.dumps(
+            {
+                "code": "EUR",
+                "rates": [
+                    {"effectiveDate": "2021-05-13", "mid": 4.6},
+                    {"effectiveDate": "2021-05-14", "mid": 4.7},
+                ],
+            }
+        )
+    )
+
+    call_command("load_exchange_rates", file=csv_dump)
+    call_command("load_exchange_rates", file=json_dump)
+
+    assert ExchangeRate.objects.count() == 3
+    assert ExchangeRate.objects.get(currency="EUR", date="2021-05-13").mid == 4.6
+
+
+@pytest.mark.django_db
+def test_offline_mode_reads_rates_from_database_only():
+    ExchangeRate.objects.create(currency="EUR", date="2021-05-14", mid=4.5)
+    friday = datetime.datetime(2021, 5, 14, 12, tzinfo=datetime.timezone.utc)
+    saturday = friday + datetime.timedelta(days=1)
+
+    prefetch_exchange_rates([("EUR", friday), ("EUR", saturday)])
+
+    assert get_exchange_rate("EUR", friday) == 4.5
+    with pytest.raises(RuntimeError):
+        get_exchange_rate("EUR", saturday)
+
+
+@pytest.mark.django_db
+def test_offline_mode_caches_missing_rates(django_assert_num_queries):
+    saturday = datetime.date(2021, 5, 15)
+
+    prefetch_exchange_rates([("EUR", saturday)])
+
+    with django_assert_num_queries(0):
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                get_exchange_rate("EUR", saturday)
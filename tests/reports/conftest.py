@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+import requests
+
+from reports.integration import rate_cache
+
+
+@pytest.fixture
+def monkeypatch_requests(request, monkeypatch):
+    """
+    NBP answering every day of a requested range with the EXCHANGE_RATE of the
+    test module. Yields the requested urls.
+    """
+    calls = []
+    rate = request.module.EXCHANGE_RATE
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, start, end):
+            self.start = datetime.date.fromisoformat(start)
+            self.end = datetime.date.fromisoformat(end)
+
+        def json(self):
+            days = (self.end - self.start).days + 1
+            return {
+                "rates": [
+                    {
+                        "effectiveDate": str(self.start + datetime.timedelta(days=i)),
+                        "mid": rate,
+                    }
+                    for i in range(days)
+                ]
+            }
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        start, end = url.rstrip("/").split("/")[-2:]
+        return MockResponse(start, end)
+
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    rate_cache.invalidate()
+    yield calls
+    rate_cache.invalidate()
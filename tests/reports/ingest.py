@@ -0,0 +1,139 @@
+import datetime
+
+import pytest
+from django.db import connection
+from rest_framework.test import APIClient
+
+from reports import ingest
+from reports.integration import rate_cache, rate_cache_key
+from reports.models import Card, DirectPayment, PayByLink, Payment, Report
+from reports.views import generate_report
+
+CARD = {
+    "created_at": "2021-05-13T09:00:05+02:00",
+    "currency": "PLN",
+    "amount": 2450,
+    "description": "REF123457",
+    "cardholder_name": "John",
+    "cardholder_surname": "Doe",
+    "card_number": "341111111111111",
+}
+DIRECT_PAYMENT = {
+    "created_at": "2021-05-14T08:27:09Z",
+    "currency": "USD",
+    "amount": 599,
+    "description": "FastFood",
+    "iban": "de91 1000 0000 0123 4567 89",
+}
+PAY_BY_LINK = {
+    "created_at": "2021-05-13T01:01:43-08:00",
+    "currency": "EUR",
+    "amount": 3000,
+    "description": "Abonament na siłownię",
+    "bank": "mbank",
+}
+PAYLOAD = {
+    "card": [CARD, {**CARD, "amount": 1}],
+    "dp": [DIRECT_PAYMENT],
+    "pay_by_link": [PAY_BY_LINK, {**PAY_BY_LINK, "bank": "ing"}, PAY_BY_LINK],
+}
+
+pytestmark = pytest.mark.django_db
+
+
+def validated_payments():
+    report, errors = generate_report(PAYLOAD)
+    assert not errors
+    return report
+
+
+def assert_payments_saved(report_id=None):
+    if report_id is None:
+        report_id = Report.objects.get().id
+    assert list(Payment.objects.values_list("report_id", flat=True)) == [report_id] * 6
+    assert sorted(Card.objects.values_list("amount", flat=True)) == [1, 2450]
+    assert list(PayByLink.objects.order_by("id").values_list("bank", flat=True)) == [
+        "mbank",
+        "ing",
+        "mbank",
+    ]
+    direct_payment = DirectPayment.objects.get()
+    assert direct_payment.iban == "DE91100000000123456789"
+    assert direct_payment.created_at == datetime.datetime(
+        2021, 5, 14, 8, 27, 9, tzinfo=datetime.timezone.utc
+    )
+    assert direct_payment.payment_ptr.description == "FastFood"
+
+
+@pytest.mark.parametrize("batch_size", [ingest.BATCH_SIZE, 2])
+def test_payments_are_inserted_in_batches(monkeypatch, batch_size):
+    monkeypatch.setattr(ingest, "BATCH_SIZE", batch_size)
+
+    report = Report.objects.create()
+
+    assert ingest.save_payments(validated_payments(), report, ingest.INSERT) == 6
+
+    assert_payments_saved(report.id)
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="COPY is specific to PostgreSQL"
+)
+def test_payments_are_copied(monkeypatch):
+    monkeypatch.setattr(ingest, "BATCH_SIZE", 2)
+
+    report = Report.objects.create()
+
+    assert ingest.save_payments(validated_payments(), report, ingest.COPY) == 6
+
+    assert_payments_saved(report.id)
+    # The sequence moved past the copied ids
+    copied = max(Payment.objects.values_list("id", flat=True))
+    assert PayByLink.objects.create(**PAY_BY_LINK).id > copied
+
+
+@pytest.fixture
+def rates():
+    rate_cache.invalidate()
+    for payment in validated_payments():
+        data = payment.validated_data
+        rate_cache.set(rate_cache_key(data["currency"], data["created_at"]), 4.0)
+    yield
+    rate_cache.invalidate()
+
+
+@pytest.mark.parametrize("persist", [True, False])
+def test_customer_report_saves_payments_when_enabled(settings, rates, persist):
+    settings.PERSIST_PAYMENTS = persist
+
+    response = APIClient().post("/customer-report/", PAYLOAD, format="json")
+
+    assert response.status_code == 201
+    if persist:
+        assert_payments_saved()
+    else:
+        assert not Payment.objects.exists()
+
+
+def test_payments_follow_report_updates(settings, rates):
+    settings.PERSIST_PAYMENTS = True
+    client = APIClient()
+    other_id = client.post("/customer-report/", PAYLOAD, format="json").json()[
+        "customer_id"
+    ]
+    customer_id = client.post("/customer-report/", PAYLOAD, format="json").json()[
+        "customer_id"
+    ]
+    body = {"customer_id": customer_id, **PAYLOAD}
+
+    client.post("/customer-report/", body, format="json")
+    assert Report.objects.get(id=customer_id).payments.count() == 6
+    assert not Card.objects.filter(payment_ptr__report=None).exists()
+
+    client.post("/customer-report/?append=1", body, format="json")
+    assert Report.objects.get(id=customer_id).payments.count() == 12
+
+    client.post("/customer-report/", {"customer_id": customer_id}, format="json")
+    assert not Report.objects.get(id=customer_id).payments.exists()
+    assert Card.objects.count() == 2
+    assert Report.objects.get(id=other_id).payments.count() == 6
@@ -0,0 +1,310 @@
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from reports import integration
+from reports.constants import NBP_API
+from reports.integration import (
+    CircuitBreaker,
+    CircuitOpenError,
+    NBPClient,
+    RateCache,
+    get_exchange_rate,
+    prefetch_exchange_rates,
+    rate_cache_key,
+    split_into_ranges,
+)
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+
+@pytest.fixture
+def nbp_server():
+    """Local stand-in for the NBP API, responses are scripted per test"""
+
+    class Handler(BaseHTTPRequestHandler):
+        statuses = []
+        delay = 0
+        requests = 0
+
+        def do_GET(self):
+            Handler.requests += 1
+            time.sleep(Handler.delay)
+            status = Handler.statuses.pop(0) if Handler.statuses else 200
+            body = json.dumps({"rates": [{"mid": 4.5}]}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except BrokenPipeError:
+                # The client gave up waiting
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.handler = Handler
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def nbp_calls(monkeypatch):
+    calls = []
+
+    class MockResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {"rates": [{"mid": 4.5}]}
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        return MockResponse()
+
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    integration.rate_cache.invalidate()
+    yield calls
+    integration.rate_cache.invalidate()
+
+
+def test_rate_cache_key_is_day_granular():
+    morning = datetime.datetime(2021, 5, 13, 1, 1, 43, tzinfo=datetime.timezone.utc)
+    evening = datetime.datetime(2021, 5, 13, 23, 59, 59, tzinfo=datetime.timezone.utc)
+    assert rate_cache_key("eur", morning) == rate_cache_key("EUR", evening)
+    assert rate_cache_key("EUR", morning) == ("EUR", datetime.date(2021, 5, 13))
+
+
+def test_rate_cache_evicts_least_recently_used_entry(timer):
+    cache = RateCache(maxsize=2, ttl=60, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_rate_cache_counts_events_per_currency(timer):
+    cache = RateCache(maxsize=1, ttl=60, timer=timer)
+    may_13 = datetime.date(2021, 5, 13)
+    cache.set(("EUR", may_13), 4.5)
+    cache.get(("EUR", may_13))
+    cache.get(("USD", may_13))
+    cache.set(("USD", may_13), 3.7)
+
+    assert cache.counts("hits") == [(("EUR",), 1)]
+    assert cache.counts("misses") == [(("USD",), 1)]
+    assert cache.counts("evictions") == [(("EUR",), 1)]
+
+
+def test_rate_cache_expires_entries_after_ttl(timer):
+    cache = RateCache(maxsize=2, ttl=60, timer=timer)
+    cache.set("a", 1)
+    timer.now = 59
+    assert cache.get("a") == 1
+    timer.now = 60
+    assert cache.get("a") is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "size": 0,
+        "maxsize": 2,
+    }
+
+
+def test_rate_cache_entry_may_have_shorter_ttl(timer):
+    cache = RateCache(maxsize=2, ttl=60, timer=timer)
+    cache.set("a", 1, ttl=5)
+    cache.set("b", 2)
+    timer.now = 5
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_rate_cache_invalidates_single_entry_and_everything(timer):
+    cache = RateCache(maxsize=4, ttl=60, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert "a" not in cache and "b" in cache
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_get_exchange_rate_asks_api_once_per_currency_and_day(nbp_calls):
+    date = datetime.datetime(2021, 5, 13, 1, 1, 43, tzinfo=datetime.timezone.utc)
+    assert get_exchange_rate("EUR", date) == 4.5
+    assert get_exchange_rate("EUR", date + datetime.timedelta(hours=5)) == 4.5
+    assert get_exchange_rate("EUR", date + datetime.timedelta(days=1)) == 4.5
+    assert len(nbp_calls) == 2
+
+
+def test_get_exchange_rate_does_not_ask_api_for_pln(nbp_calls):
+    assert get_exchange_rate("PLN", datetime.date(2021, 5, 13)) == 1.0
+    assert nbp_calls == []
+
+
+def test_split_into_ranges_respects_api_range_limit():
+    start = datetime.date(2021, 1, 1)
+    dates = [start + datetime.timedelta(days=d) for d in (0, 50, 92, 93, 200)]
+    assert split_into_ranges(dates) == [
+        (dates[0], dates[2]),
+        (dates[3], dates[3]),
+        (dates[4], dates[4]),
+    ]
+
+
+def test_prefetch_exchange_rates_caches_missing_days(monkeypatch):
+    calls = []
+
+    class MockResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {
+                "rates": [
+                    {"effectiveDate": "2021-05-14", "mid": 4.5},
+                    {"effectiveDate": "2021-05-17", "mid": 4.6},
+                ]
+            }
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        return MockResponse()
+
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    integration.rate_cache.invalidate()
+    friday, saturday, monday = (
+        datetime.date(2021, 5, 14),
+        datetime.date(2021, 5, 15),
+        datetime.date(2021, 5, 17),
+    )
+    prefetch_exchange_rates(
+        [("EUR", friday), ("EUR", saturday), ("EUR", monday), ("PLN", monday)]
+    )
+    assert calls == [f"{NBP_API}/api/exchangerates/rates/a/eur/2021-05-14/2021-05-17/"]
+    assert get_exchange_rate("EUR", friday) == 4.5
+    assert get_exchange_rate("EUR", monday) == 4.6
+    with pytest.raises(RuntimeError):
+        get_exchange_rate("EUR", saturday)
+    assert len(calls) == 1
+    integration.rate_cache.invalidate()
+
+
+def test_nbp_client_retries_server_errors(nbp_server):
+    nbp_server.handler.statuses = [503, 502]
+    client = NBPClient(base_url=nbp_server.url, retries=3, backoff_factor=0)
+    response = client.get("/api/exchangerates/rates/a/eur/2021-05-14/2021-05-14/")
+    assert response.status_code == 200
+    assert response.json() == {"rates": [{"mid": 4.5}]}
+    assert nbp_server.handler.requests == 3
+
+
+def test_nbp_client_records_request_durations(nbp_server):
+    duration = integration.nbp_request_duration
+    before = duration.count("sync", "200"), duration.count("sync", "404")
+    nbp_server.handler.statuses = [404]
+    client = NBPClient(base_url=nbp_server.url, retries=0)
+    client.get("/api/exchangerates/rates/a/eur/2021-05-15/2021-05-15/")
+    client.get("/api/exchangerates/rates/a/eur/2021-05-14/2021-05-14/")
+
+    after = duration.count("sync", "200"), duration.count("sync", "404")
+    assert (after[0] - before[0], after[1] - before[1]) == (1, 1)
+
+
+def test_nbp_client_times_out_on_slow_responses(nbp_server):
+    nbp_server.handler.delay = 0.5
+    client = NBPClient(base_url=nbp_server.url, timeout=(1, 0.1), retries=0)
+    started = time.monotonic()
+    with pytest.raises(requests.RequestException):
+        client.get("/api/exchangerates/rates/a/eur/2021-05-14/2021-05-14/")
+    assert time.monotonic() - started < 0.5
+
+
+def test_nbp_client_fails_fast_while_circuit_is_open(nbp_server):
+    timer = FakeTimer()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, timer=timer)
+    client = NBPClient(
+        base_url=nbp_server.url, retries=0, backoff_factor=0, breaker=breaker
+    )
+    nbp_server.handler.statuses = [500, 500]
+    path = "/api/exchangerates/rates/a/eur/2021-05-14/2021-05-14/"
+    assert client.get(path).status_code == 500
+    assert client.get(path).status_code == 500
+
+    with pytest.raises(CircuitOpenError):
+        client.get(path)
+    assert nbp_server.handler.requests == 2
+
+    timer.now = 30
+    assert client.get(path).status_code == 200
+    assert client.get(path).status_code == 200
+    assert nbp_server.handler.requests == 4
+
+
+def test_prefetch_exchange_rates_resolves_currencies_concurrently(
+    settings, monkeypatch
+):
+    settings.EXCHANGE_RATE_WORKERS = 4
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    class MockResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {"rates": [{"effectiveDate": "2021-05-14", "mid": 4.5}]}
+
+    def mock_get(session, url, *args, **kwargs):
+        with lock:
+            in_flight.append(url)
+            peak.append(len(in_flight))
+        time.sleep(0.2)
+        with lock:
+            in_flight.remove(url)
+        return MockResponse()
+
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    integration.rate_cache.invalidate()
+    friday = datetime.date(2021, 5, 14)
+
+    started = time.monotonic()
+    prefetch_exchange_rates([("EUR", friday), ("USD", friday), ("GBP", friday)])
+
+    assert time.monotonic() - started < 0.5
+    assert max(peak) == 3
+    assert all(
+        get_exchange_rate(currency, friday) == 4.5 for currency in ("EUR", "USD", "GBP")
+    )
+    integration.rate_cache.invalidate()
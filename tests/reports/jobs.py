@@ -0,0 +1,192 @@
+import datetime
+import io
+
+import orjson
+import pytest
+from django.core.management import call_command
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from reports import jobs, views
+from reports.models import Report, ReportJob
+
+EXCHANGE_RATE = 2
+PAYMENTS = {
+    "pay_by_link": [
+        {
+            "created_at": "2021-05-13T01:01:43-08:00",
+            "currency": "EUR",
+            "amount": 3000,
+            "description": "Abonament na siłownię",
+            "bank": "mbank",
+        }
+    ],
+}
+
+# Workers are threads with connections of their own, they see committed data only
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.usefixtures("monkeypatch_requests"),
+]
+
+
+def run_workers(**options):
+    call_command("run_report_workers", burst=True, stdout=io.StringIO(), **options)
+
+
+def submit(client, body, url="/customer-report/jobs/", **kwargs):
+    response = client.post(url, body, **kwargs)
+    assert response.status_code == 202
+    return response
+
+
+def abandoned_job(attempts):
+    return ReportJob.objects.create(
+        payload=b"{}",
+        status=ReportJob.RUNNING,
+        attempts=attempts,
+        lease_expires_at=timezone.now() - datetime.timedelta(seconds=1),
+    )
+
+
+def test_submitted_report_is_built_by_workers():
+    client = APIClient()
+    response = submit(client, PAYMENTS, format="json")
+    job_id = response.json()["job_id"]
+    assert response.json()["status"] == ReportJob.PENDING
+    assert response["Location"] == f"/customer-report/jobs/{job_id}/"
+
+    run_workers(workers=2)
+
+    job = client.get(f"/customer-report/jobs/{job_id}/").json()
+    assert job["status"] == ReportJob.DONE
+    assert job["attempts"] == 1
+    report = client.get(f"/customer-report/{job['customer_id']}/").json()
+    assert [row["amount_in_pln"] for row in report] == [3000 * EXCHANGE_RATE]
+
+
+def test_job_updates_existing_report():
+    client = APIClient()
+    customer_id = client.post("/customer-report/", PAYMENTS, format="json").json()[
+        "customer_id"
+    ]
+    body = {"customer_id": customer_id, **PAYMENTS}
+    submit(client, body, format="json")
+    submit(client, body, "/customer-report/jobs/?append=1", format="json")
+
+    run_workers(workers=1)
+
+    assert set(ReportJob.objects.values_list("report_id", flat=True)) == {customer_id}
+    assert len(client.get(f"/customer-report/{customer_id}/").json()) == 2
+
+
+def test_invalid_payments_fail_job_with_errors():
+    client = APIClient()
+    invalid = {"pay_by_link": [dict(PAYMENTS["pay_by_link"][0], currency="XXX")]}
+    job_id = submit(client, invalid, format="json").json()["job_id"]
+
+    run_workers()
+
+    job = client.get(f"/customer-report/jobs/{job_id}/").json()
+    assert job["status"] == ReportJob.FAILED
+    assert job["customer_id"] is None
+    assert job["errors"] == client.post("/report/", invalid, format="json").json()
+
+
+def test_malformed_payload_fails_job():
+    client = APIClient()
+    response = submit(client, b'{"pay_by_link": [', content_type="application/json")
+    job_id = response.json()["job_id"]
+
+    run_workers()
+
+    job = client.get(f"/customer-report/jobs/{job_id}/").json()
+    assert job["status"] == ReportJob.FAILED
+    assert job["errors"]["detail"].startswith("JSON parse error")
+
+
+def test_only_json_is_accepted():
+    response = APIClient().post(
+        "/customer-report/jobs/", "a,b", content_type="text/csv"
+    )
+    assert response.status_code == 415
+    assert not ReportJob.objects.exists()
+
+
+def test_unknown_job_is_not_found():
+    assert APIClient().get("/customer-report/jobs/1/").status_code == 404
+
+
+def test_job_of_crashed_worker_is_retried():
+    job = abandoned_job(attempts=1)
+
+    run_workers()
+
+    job.refresh_from_db()
+    assert job.status == ReportJob.DONE
+    assert job.attempts == 2
+
+
+def test_job_crashing_every_worker_is_given_up(settings):
+    job = abandoned_job(attempts=settings.REPORT_JOB_MAX_ATTEMPTS)
+
+    assert jobs.claim_jobs(1) == []
+
+    job.refresh_from_db()
+    assert job.status == ReportJob.FAILED
+    assert job.finished_at is not None
+
+
+def test_failing_job_is_retried_up_to_max_attempts(settings, monkeypatch):
+    def generate_report(data):
+        raise RuntimeError("Out of memory")
+
+    monkeypatch.setattr(jobs, "generate_report", generate_report)
+    job = ReportJob.objects.create(payload=b"{}")
+
+    run_workers()
+
+    job.refresh_from_db()
+    assert job.status == ReportJob.FAILED
+    assert job.attempts == settings.REPORT_JOB_MAX_ATTEMPTS
+
+
+def test_job_is_claimed_once():
+    ReportJob.objects.bulk_create([ReportJob(payload=b"{}") for _ in range(3)])
+
+    first, second = jobs.claim_jobs(2), jobs.claim_jobs(2)
+
+    assert len(first) == 2 and len(second) == 1
+    assert not {job.id for job in first} & {job.id for job in second}
+    assert jobs.claim_jobs(2) == []
+
+
+def test_worker_which_lost_lease_cannot_finish_job():
+    ReportJob.objects.create(payload=b"{}")
+    (job,) = jobs.claim_jobs(1)
+    ReportJob.objects.filter(id=job.id).update(
+        lease_expires_at=timezone.now() - datetime.timedelta(seconds=1)
+    )
+    (reclaimed,) = jobs.claim_jobs(1)
+
+    assert not jobs.finish_job(job, ReportJob.DONE)
+    assert jobs.finish_job(reclaimed, ReportJob.DONE)
+
+
+def test_worker_which_lost_lease_rolls_back_report(monkeypatch):
+    def save_report(*args, **kwargs):
+        report = views.save_report(*args, **kwargs)
+        # Meanwhile another worker claims the job again
+        ReportJob.objects.update(attempts=F("attempts") + 1)
+        return report
+
+    monkeypatch.setattr(jobs, "save_report", save_report)
+    ReportJob.objects.create(payload=orjson.dumps(PAYMENTS))
+    (job,) = jobs.claim_jobs(1)
+
+    assert not jobs.build_report(job)
+
+    assert not Report.objects.exists()
+    job.refresh_from_db()
+    assert job.status == ReportJob.RUNNING
@@ -0,0 +1,128 @@
+import pytest
+from rest_framework.test import APIClient
+
+from reports.integration import exchange_rate_errors
+from reports.metrics import Histogram, Registry, request_timings, timed
+
+BODY = {
+    "pay_by_link": [
+        {
+            "created_at": "2021-05-13T01:01:43-08:00",
+            "currency": "EUR",
+            "amount": 3000,
+            "description": "Abonament na siłownię",
+            "bank": "mbank",
+        }
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_rates(monkeypatch):
+    monkeypatch.setattr("reports.views.prefetch_exchange_rates", lambda pairs: None)
+    monkeypatch.setattr(
+        "reports.serializers.get_exchange_rate", lambda currency, date: 4
+    )
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram(
+        "report_seconds", 'Time "spent"', ("phase",), buckets=(0.1, 1)
+    )
+    histogram.observe(0.05, "parse")
+    histogram.observe(0.5, "parse")
+    histogram.observe(5, "parse")
+
+    assert registry.render().splitlines() == [
+        '# HELP report_seconds Time \\"spent\\"',
+        "# TYPE report_seconds histogram",
+        'report_seconds_bucket{phase="parse",le="0.1"} 1',
+        'report_seconds_bucket{phase="parse",le="1"} 2',
+        'report_seconds_bucket{phase="parse",le="+Inf"} 3',
+        'report_seconds_sum{phase="parse"} 5.55',
+        'report_seconds_count{phase="parse"} 3',
+    ]
+
+
+def test_registry_refuses_duplicate_names():
+    registry = Registry()
+    registry.register(Histogram("report_seconds", ""))
+    with pytest.raises(ValueError):
+        registry.register(Histogram("report_seconds", ""))
+
+
+def test_timed_adds_up_phases_of_current_request():
+    @timed("validate")
+    def validate():
+        pass
+
+    timings = {}
+    token = request_timings.set(timings)
+    try:
+        validate()
+        validate()
+        with timed("render"):
+            pass
+    finally:
+        request_timings.reset(token)
+
+    assert list(timings) == ["validate", "render"]
+    # Outside of a request nothing is recorded
+    validate()
+
+
+def test_report_has_server_timing_header():
+    response = APIClient().post("/report/", BODY, format="json")
+
+    phases = [metric.split(";")[0] for metric in response["Server-Timing"].split(", ")]
+    assert phases == ["parse", "validate", "rates", "serialize", "render", "total"]
+
+
+def test_server_timing_header_can_be_disabled(settings):
+    settings.SERVER_TIMING = False
+    response = APIClient().post("/report/", BODY, format="json")
+    assert not response.has_header("Server-Timing")
+
+
+def test_metrics_endpoint_exposes_request_histograms():
+    client = APIClient()
+    client.post("/report/", BODY, format="json")
+
+    response = client.get("/metrics")
+
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    content = response.content.decode()
+    assert (
+        'http_request_duration_seconds_count{route="report/",method="POST",status="200"}'
+        in content
+    )
+    assert (
+        'http_request_phase_duration_seconds_count{route="report/",phase="validate"}'
+        in content
+    )
+
+
+def test_metrics_endpoint_exposes_exchange_rate_metrics(monkeypatch):
+    def failing_rate(currency, date):
+        raise RuntimeError("No exchange rate")
+
+    errors = exchange_rate_errors.value("EUR")
+    monkeypatch.setattr("reports.serializers.get_exchange_rate", failing_rate)
+    response = APIClient().post("/report/", BODY, format="json")
+    assert response.json()[0]["amount_in_pln"] is None
+    assert exchange_rate_errors.value("EUR") == errors + 1
+
+    content = APIClient().get("/metrics").content.decode()
+    for name in (
+        "exchange_rate_cache_hits_total",
+        "exchange_rate_cache_misses_total",
+        "exchange_rate_cache_evictions_total",
+        "exchange_rate_cache_size",
+        "exchange_rate_lookup_errors_total",
+        "nbp_request_duration_seconds",
+    ):
+        assert f"# TYPE {name} " in content
+    assert (
+        f'exchange_rate_lookup_errors_total{{currency="EUR"}} {errors + 1}' in content
+    )
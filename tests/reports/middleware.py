@@ -0,0 +1,67 @@
+import gzip
+
+import pytest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+
+from reports import encoding
+from reports.middleware import CompressionMiddleware
+
+CONTENT = b'{"amount": 2450, "currency": "PLN"}' * 100
+
+
+def respond(accept_encoding, response):
+    request = RequestFactory().get("/report/", HTTP_ACCEPT_ENCODING=accept_encoding)
+    return CompressionMiddleware(lambda request: response)(request)
+
+
+def test_response_is_gzipped():
+    response = respond("gzip, deflate", HttpResponse(CONTENT))
+
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Vary"] == "Accept-Encoding"
+    assert int(response["Content-Length"]) == len(response.content)
+    assert gzip.decompress(response.content) == CONTENT
+
+
+@pytest.mark.parametrize("accept_encoding", ["", "identity", "gzip;q=0, br;q=0"])
+def test_response_is_not_compressed_unless_accepted(accept_encoding):
+    response = respond(accept_encoding, HttpResponse(CONTENT))
+
+    assert not response.has_header("Content-Encoding")
+    assert response.content == CONTENT
+
+
+def test_short_response_is_not_compressed(settings):
+    settings.RESPONSE_COMPRESSION_MIN_SIZE = len(CONTENT) + 1
+    response = respond("gzip", HttpResponse(CONTENT))
+
+    assert not response.has_header("Content-Encoding")
+
+
+def test_encoded_response_is_passed_through():
+    response = HttpResponse(CONTENT)
+    response["Content-Encoding"] = "zstd"
+    response = respond("gzip", response)
+
+    assert response["Content-Encoding"] == "zstd"
+    assert response.content == CONTENT
+
+
+def test_brotli_is_preferred_when_available(monkeypatch):
+    monkeypatch.setattr(encoding, "brotli", lambda: None)
+    monkeypatch.setattr(
+        "reports.middleware.compress", lambda content, encoding: encoding.encode()
+    )
+    response = respond("gzip, br", HttpResponse(CONTENT))
+    assert response["Content-Encoding"] == "br"
+
+    response = respond("gzip, br;q=0.5", HttpResponse(CONTENT))
+    assert response["Content-Encoding"] == "gzip"
+
+
+def test_streaming_response_is_gzipped():
+    response = respond("br, gzip", StreamingHttpResponse(iter([CONTENT, CONTENT])))
+
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(response.streaming_content)) == CONTENT * 2
@@ -0,0 +1,76 @@
+import datetime
+import decimal
+import io
+import uuid
+
+import pytest
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from reports.parsers import ORJSONParser
+from reports.renderers import ORJSONRenderer
+
+DATA = {
+    "customer_id": 12345,
+    "report": [
+        {
+            "date": "2021-05-13T09:00:05Z",
+            "type": "card",
+            "payment_mean": "John Doe 3411********1111",
+            "description": "Zakupy spożywcze",
+            "currency": "PLN",
+            "amount": 2450,
+            "amount_in_pln": 2450,
+        }
+    ],
+}
+
+
+def test_renderer_matches_drf():
+    assert ORJSONRenderer().render(DATA) == JSONRenderer().render(DATA)
+
+
+def test_renderer_encodes_python_types_natively():
+    content = ORJSONRenderer().render(
+        {
+            "date": datetime.datetime(
+                2021, 5, 13, 9, 0, 5, tzinfo=datetime.timezone.utc
+            ),
+            "day": datetime.date(2021, 5, 13),
+            "id": uuid.UUID(int=1),
+            "amount": decimal.Decimal("24.50"),
+            "rows": (row for row in [1, 2]),
+        }
+    )
+
+    assert content == (
+        b'{"date":"2021-05-13T09:00:05Z","day":"2021-05-13",'
+        b'"id":"00000000-0000-0000-0000-000000000001","amount":24.5,"rows":[1,2]}'
+    )
+
+
+def test_renderer_indents_on_request():
+    content = ORJSONRenderer().render(DATA, "application/json; indent=4")
+    assert content.startswith(b'{\n  "customer_id"')
+
+
+def test_parser_matches_drf():
+    content = JSONRenderer().render(DATA)
+    assert ORJSONParser().parse(io.BytesIO(content)) == JSONParser().parse(
+        io.BytesIO(content)
+    )
+
+
+@pytest.mark.parametrize("content", [b'{"amount": NaN}', b'{"amount": 1', b"\xff"])
+def test_parser_rejects_invalid_json(content):
+    with pytest.raises(ParseError):
+        ORJSONParser().parse(io.BytesIO(content))
+
+
+def test_parser_decodes_other_charsets():
+    content = '{"description": "Zakupy spożywcze"}'.encode("utf-16")
+    data = ORJSONParser().parse(
+        io.BytesIO(content), parser_context={"encoding": "utf-16"}
+    )
+    assert data == {"description": "Zakupy spożywcze"}
@@ -0,0 +1,112 @@
+import datetime
+import io
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+from rest_framework.exceptions import ParseError
+
+from reports.streaming import PaymentStream, in_chronological_order
+from reports.validation import ValidatedPayment
+
+BODY = {
+    "pay_by_link": [
+        {
+            "created_at": "2021-05-13T01:01:43-08:00",
+            "currency": "EUR",
+            "amount": 3000,
+            "description": "Abonament na siłownię",
+            "bank": "mbank",
+        }
+    ],
+    "customer_id": 12345,
+    "dp": [],
+    "card": [
+        {
+            "created_at": "2021-05-13T09:00:05+02:00",
+            "currency": "PLN",
+            "amount": 2450,
+            "description": "REF123457",
+            "cardholder_name": "John",
+            "cardholder_surname": "Doe",
+            "card_number": "341111111111111",
+        },
+        {"amount": 1.5e3, "description": None},
+    ],
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 11, 19, 21, 33, 64 * 1024])
+def test_payment_stream_yields_payments_in_document_order(chunk_size):
+    stream = PaymentStream(
+        io.BytesIO(json.dumps(BODY, indent=2, ensure_ascii=False).encode()),
+        chunk_size=chunk_size,
+    )
+    assert list(stream) == [
+        ("pay_by_link", BODY["pay_by_link"][0]),
+        ("card", BODY["card"][0]),
+        ("card", BODY["card"][1]),
+    ]
+    assert stream.pop("customer_id") == 12345
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 11, 19, 21, 33, 64 * 1024])
+def test_payment_stream_reads_numbers_split_between_chunks(chunk_size):
+    body = b'{"customer_id": 12.5e1, "dp": [1.25, -3E-2, 40, 5e+1, 0.5], "card": [7]}'
+    stream = PaymentStream(io.BytesIO(body), chunk_size=chunk_size)
+    assert list(stream) == [
+        ("dp", 1.25),
+        ("dp", -3e-2),
+        ("dp", 40),
+        ("dp", 5e1),
+        ("dp", 0.5),
+        ("card", 7),
+    ]
+    assert stream.pop("customer_id") == 125.0
+
+
+@pytest.mark.parametrize(
+    "body", [b"", b"{}", b" { } ", b'{"dp": null}', b'{"card": []}']
+)
+def test_payment_stream_handles_bodies_without_payments(body):
+    assert list(PaymentStream(io.BytesIO(body))) == []
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"dp": [{"amount": 1}',
+        b'{"dp": [{"amount": 1}] "card": []}',
+        b'{"dp": []}{}',
+        b'{"dp": [NaN]}',
+        b"[]",
+    ],
+)
+def test_payment_stream_rejects_malformed_json(body):
+    with pytest.raises(ParseError):
+        list(PaymentStream(io.BytesIO(body), chunk_size=4))
+
+
+def make_payments(payment_type, days):
+    serializer = SimpleNamespace(payment_type=payment_type)
+    return [
+        ValidatedPayment(
+            serializer,
+            {"created_at": datetime.datetime(2021, 5, day), "type": payment_type},
+        )
+        for day in days
+    ]
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_in_chronological_order_matches_stable_sort(shuffle):
+    report = (
+        make_payments("dp", [1, 3, 3, 7])
+        + make_payments("card", [2, 3, 9])
+        + make_payments("pay_by_link", [1, 3, 8, 8])
+    )
+    if shuffle:
+        random.Random(0).shuffle(report)
+    expected = sorted(report, key=lambda p: p.validated_data["created_at"])
+    assert list(in_chronological_order(report)) == expected
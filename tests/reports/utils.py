@@ -1,6 +1,6 @@
 import pytest
 
-from reports.utils import mask_card_number
+from reports.utils import mask_card_number, mask_card_numbers
 
 
 @pytest.mark.parametrize(
@@ -14,3 +14,20 @@ from reports.utils import mask_card_number
 )
 def test_mask_card_number_masks_correctly(input_card, masked_card):
     assert mask_card_number(input_card) == masked_card
+
+
+def test_mask_card_numbers_matches_mask_card_number():
+    card_numbers = [
+        "341111111111111",
+        "6011000990139424",
+        "111111111",
+        "12345678",
+        "1234",
+        "",
+        "3411 1111 1111 111",
+        "٣٤١١١١١١١١١١١١١",
+        "378282246310005",
+    ]
+    assert mask_card_numbers(card_numbers) == [
+        mask_card_number(card_number) for card_number in card_numbers
+    ]
@@ -0,0 +1,168 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from reports import serializers, validation
+from reports.serializers import (
+    ByLinkPaymentSerializer,
+    CardPaymentSerializer,
+    DirectPaymentSerializer,
+)
+from reports.validation import BatchValidator
+from reports.views import generate_report
+
+CARD = {
+    "created_at": "2021-05-13T09:00:05+02:00",
+    "currency": "PLN",
+    "amount": 2450,
+    "description": "REF123457",
+    "cardholder_name": "John",
+    "cardholder_surname": "Doe",
+    "card_number": "341111111111111",
+}
+DIRECT_PAYMENT = {
+    "created_at": "2021-05-14T08:27:09Z",
+    "currency": "USD",
+    "amount": 599,
+    "description": "FastFood",
+    "iban": "DE91100000000123456789",
+}
+PAY_BY_LINK = {
+    "created_at": "2021-05-13T01:01:43-08:00",
+    "currency": "EUR",
+    "amount": 3000,
+    "description": "Abonament na siłownię",
+    "bank": "mbank",
+}
+
+
+@pytest.mark.parametrize(
+    "serializer_class,items",
+    [
+        (
+            CardPaymentSerializer,
+            [
+                CARD,
+                {**CARD, "card_number": "6011000990139425"},
+                {**CARD, "card_number": "60110009901394250"},
+                {**CARD, "card_number": 378282246310005},
+                {**CARD, "card_number": ""},
+            ],
+        ),
+        (
+            DirectPaymentSerializer,
+            [
+                DIRECT_PAYMENT,
+                {**DIRECT_PAYMENT, "iban": "DE91100000000123456788"},
+                {**DIRECT_PAYMENT, "iban": "XX91100000000123456789"},
+                {**DIRECT_PAYMENT, "iban": "de91 1000-0000 0123 4567 89"},
+                {**DIRECT_PAYMENT, "iban": "DE9110000000012345678"},
+                {**DIRECT_PAYMENT, "iban": "DE91100000000123456789" * 2},
+                {**DIRECT_PAYMENT, "iban": "BE71096123456769"},
+                {**DIRECT_PAYMENT, "iban": 91100000000123456789},
+            ],
+        ),
+        (
+            ByLinkPaymentSerializer,
+            [
+                PAY_BY_LINK,
+                {**PAY_BY_LINK, "currency": "ABC", "amount": -1},
+                {key: None for key in PAY_BY_LINK},
+                {},
+                None,
+                "payment",
+            ],
+        ),
+    ],
+)
+def test_batch_validator_matches_serializer(serializer_class, items):
+    expected_data, expected_errors = [], []
+    for item in items:
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            expected_data.append(serializer.validated_data)
+        else:
+            expected_errors.append(serializer.errors)
+
+    validated, errors = BatchValidator(serializer_class).validate(items)
+
+    assert [payment.validated_data for payment in validated] == expected_data
+    assert errors == expected_errors
+    assert [list(e) for e in errors] == [list(e) for e in expected_errors]
+
+
+@pytest.fixture
+def process_pool(settings):
+    settings.REPORT_VALIDATION_PROCESSES = 2
+    settings.REPORT_VALIDATION_CHUNK_SIZE = 2
+    yield
+    validation.shutdown_process_pool()
+
+
+def mixed_payload():
+    return {
+        "card": [CARD, {**CARD, "card_number": "1234"}, CARD, CARD, {}],
+        "dp": [{**DIRECT_PAYMENT, "iban": "XX91100000000123456789"}, DIRECT_PAYMENT],
+        "pay_by_link": [PAY_BY_LINK] * 3 + [None, {**PAY_BY_LINK, "amount": -1}],
+    }
+
+
+def test_validation_in_processes_matches_serial(settings, process_pool, monkeypatch):
+    monkeypatch.setattr(serializers, "get_exchange_rate", lambda currency, date: 4)
+    report, errors = generate_report(mixed_payload())
+
+    settings.REPORT_VALIDATION_PROCESSES = 0
+    expected_report, expected_errors = generate_report(mixed_payload())
+
+    assert [p.validated_data for p in report] == [
+        p.validated_data for p in expected_report
+    ]
+    assert [p.data for p in report] == [p.data for p in expected_report]
+    assert errors == expected_errors
+
+
+def test_broken_process_pool_falls_back_to_serial_validation(process_pool, monkeypatch):
+    class BrokenPool:
+        def submit(self, *args):
+            raise BrokenProcessPool()
+
+    monkeypatch.setattr(validation, "process_pool", BrokenPool)
+
+    report, errors = generate_report(mixed_payload())
+
+    assert len(report) == 7 and len(errors) == 5
+
+
+def test_pool_shut_down_by_another_thread_falls_back_to_serial_validation(
+    process_pool, monkeypatch
+):
+    class ShutDownPool:
+        def submit(self, *args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    current = validation.process_pool()
+    monkeypatch.setattr(validation, "process_pool", ShutDownPool)
+
+    report, errors = generate_report(mixed_payload())
+
+    assert len(report) == 7 and len(errors) == 5
+    # The pool started by the other thread is kept
+    assert validation._pool is current
+
+
+def test_validation_error_of_pool_process_is_raised(process_pool, monkeypatch):
+    class FailingPool:
+        def submit(self, *args):
+            future = Future()
+            future.set_exception(RuntimeError("Out of memory"))
+            return future
+
+    current = validation.process_pool()
+    monkeypatch.setattr(validation, "process_pool", FailingPool)
+
+    with pytest.raises(RuntimeError, match="Out of memory"):
+        generate_report(mixed_payload())
+
+    # A healthy pool is kept
+    assert validation._pool is current
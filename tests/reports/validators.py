@@ -1,6 +1,18 @@
+import random
+import re
+
 import pytest
+from django.core.exceptions import ValidationError
+from localflavor.generic.validators import IBANValidator
+from stdnum import iban, numdb
 
-from reports.validators import check_card
+from reports.validators import (
+    card_validator,
+    check_card,
+    check_cards,
+    iban_validator,
+    prechecked_cards,
+)
 
 
 @pytest.mark.parametrize(
@@ -17,3 +29,117 @@ from reports.validators import check_card
 )
 def test_card_validator_returns_correct_anwsers(input_card, expected_output):
     assert check_card(input_card) == expected_output
+
+
+def random_card_numbers(count):
+    rng = random.Random(0)
+    return [
+        "".join(rng.choice("0123456789") for _ in range(rng.randint(1, 19)))
+        for _ in range(count)
+    ]
+
+
+def test_check_cards_matches_check_card():
+    card_numbers = random_card_numbers(5000) + [
+        "341111111111111",
+        "6011000990139424",
+        "3411 1111 1111 111",
+        "3411-1111-1111-112",
+        "٣٤١١١١١١١١١١١١١",
+    ]
+    assert check_cards(card_numbers).tolist() == [
+        check_card(card_number) for card_number in card_numbers
+    ]
+
+
+def test_check_cards_of_nothing():
+    assert check_cards([]).tolist() == []
+
+
+@pytest.mark.parametrize("card_number", ["341111111111111", "6011000990139425"])
+def test_card_validator_uses_prechecked_cards(monkeypatch, card_number):
+    with prechecked_cards([card_number]):
+        monkeypatch.setattr("reports.validators.check_card", None)
+        if check_card(card_number):
+            card_validator(card_number)
+        else:
+            with pytest.raises(ValidationError):
+                card_validator(card_number)
+
+
+def random_ibans(count):
+    """Valid IBANs of countries without national checks"""
+    rng = random.Random(0)
+    chars = {"n": "0123456789", "a": "ABCXYZ", "c": "0123456789ABCXYZ"}
+    registry = numdb.get("iban")
+    country_codes = sorted(
+        country_code
+        for country_code, (_, pattern, module) in iban_validator.formats.items()
+        if pattern is not None and module is None
+    )
+    ibans = []
+    for _ in range(count):
+        country_code = rng.choice(country_codes)
+        structure = registry.info(country_code)[0][1]["bban"]
+        bban = "".join(
+            rng.choice(chars[kind])
+            for length, kind in re.findall(r"(\d+)!([nac])", structure)
+            for _ in range(int(length))
+        )
+        ibans.append(
+            country_code + iban.calc_check_digits(country_code + "00" + bban) + bban
+        )
+    return ibans
+
+
+def describe(error):
+    if error is None:
+        return None
+    return [(error.message, error.code, error.params) for error in error.error_list]
+
+
+def scalar_error(value):
+    try:
+        IBANValidator()(value)
+    except ValidationError as exc:
+        return exc
+    return None
+
+
+def test_batch_iban_validator_matches_iban_validator():
+    valid = random_ibans(2000)
+    values = (
+        valid
+        + [value[:2] + "00" + value[4:] for value in valid[:200]]
+        + [value[:-1] for value in valid[:200]]
+        + [
+            "DE91100000000123456789",
+            "de91 1000-0000 0123 4567 89",
+            "DE9X100000000123456789",
+            "DE91100000000123456789!",
+            "DE91.100000000123456789",
+            "BE71096123456769",
+            "BE68539007547034",
+            "AO06004400006729503010102",
+            "XX91100000000123456789",
+            "D",
+            "",
+        ]
+    )
+
+    results = iban_validator.check(values)
+
+    assert results[:2000] == [None] * 2000
+    assert [describe(error) for error in results] == [
+        describe(scalar_error(value)) for value in values
+    ]
+
+
+def test_batch_iban_validator_uses_prechecked_ibans(monkeypatch):
+    with iban_validator.prechecked(
+        ["DE91100000000123456789", "DE00100000000123456789"]
+    ):
+        monkeypatch.setattr(IBANValidator, "__call__", None)
+        iban_validator("DE91100000000123456789")
+        with pytest.raises(ValidationError):
+            iban_validator("DE00100000000123456789")
@@ -1,27 +1,32 @@
+import base64
+import gzip
+import json
 from collections import namedtuple
 
 import pytest
-import requests
+from django.core.cache import cache
+from django.core.checks import run_checks
 from rest_framework.test import APIClient
 
+from reports import checks
 from reports.models import Report
+from reports.serializers import ReportSerializer
 
 EXCHANGE_RATE = 2
 
+pytestmark = pytest.mark.usefixtures("monkeypatch_requests")
 
-@pytest.fixture(autouse=True)
-def monkeypatch_requests(monkeypatch):
-    class MockResponse:
-        status_code = 200
 
-        @staticmethod
-        def json():
-            return {"rates": [{"mid": EXCHANGE_RATE}]}
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Rendered reports are cached by id and ids are reused between tests
+    cache.clear()
 
-    def mock_get(*args, **kwargs):
-        return MockResponse()
 
-    monkeypatch.setattr(requests, "get", mock_get)
+def response_json(response):
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))
+    return response.json()
 
 
 TestData = namedtuple("TestData", ["request_body", "expected_response"])
@@ -244,10 +249,11 @@ class TestReportView:
         assert response.status_code == 400
         assert response.json() == data.expected_response
 
-    def test_response_returns_report_in_chronological_order(self):
+    @pytest.mark.parametrize("url", ["/report/", "/report/?stream=1"])
+    def test_response_returns_report_in_chronological_order(self, url):
         client = APIClient()
         response = client.post(
-            "/report/",
+            url,
             {
                 "pay_by_link": [
                     {
@@ -291,7 +297,7 @@ class TestReportView:
             format="json",
         )
         assert response.status_code == 200
-        assert response.json() == [
+        assert response_json(response) == [
             {
                 "date": "2021-05-13T07:00:05Z",
                 "type": "card",
@@ -330,6 +336,135 @@ class TestReportView:
             },
         ]
 
+    def test_report_view_fetches_rates_with_one_request_per_currency(
+        self, monkeypatch_requests
+    ):
+        client = APIClient()
+        response = client.post(
+            "/report/",
+            {
+                "pay_by_link": [
+                    {
+                        "created_at": f"2021-05-{day:02}T01:01:43Z",
+                        "currency": "EUR",
+                        "amount": 3000,
+                        "description": "Abonament na siłownię",
+                        "bank": "mbank",
+                    }
+                    for day in range(1, 29)
+                ],
+                "dp": [
+                    {
+                        "created_at": "2021-05-14T08:27:09Z",
+                        "currency": "USD",
+                        "amount": 599,
+                        "description": "FastFood",
+                        "iban": "DE91100000000123456789",
+                    }
+                ],
+            },
+            format="json",
+        )
+        assert response.status_code == 200
+        assert len(response.json()) == 29
+        assert len(monkeypatch_requests) == 2
+        assert all(
+            row["amount_in_pln"] == row["amount"] * EXCHANGE_RATE
+            for row in response.json()
+        )
+
+    def test_streamed_body_is_validated_like_parsed_one(self):
+        invalid_card = {"amount": -1}
+        invalid_dp = {"iban": "XX"}
+        body = '{"card": [%s], "dp": [%s], "card": [%s, %s]}' % tuple(
+            json.dumps(p) for p in ({}, invalid_dp, invalid_card, {})
+        )
+        responses = [
+            APIClient().post(url, body, content_type="application/json")
+            for url in ("/report/", "/report/?stream=1")
+        ]
+        assert responses[0].status_code == responses[1].status_code == 400
+        # Errors grouped by type, the repeated card key replaces the first array
+        assert responses[1].json() == responses[0].json()
+        assert len(responses[0].json()) == 3
+
+    def test_streamed_body_of_unsupported_media_type_is_rejected(self):
+        response = APIClient().post("/report/?stream=1", "a,b", content_type="text/csv")
+        assert response.status_code == 415
+
+
+class TestReportViewPagination:
+    request_body = {
+        "pay_by_link": [
+            {
+                "created_at": f"2021-05-{day:02}T12:00:00Z",
+                "currency": "EUR",
+                "amount": day,
+                "description": "Abonament na siłownię",
+                "bank": "mbank",
+            }
+            for day in range(20, 0, -2)
+        ],
+        "dp": [
+            {
+                "created_at": f"2021-05-{day:02}T12:00:00Z",
+                "currency": "USD",
+                "amount": day,
+                "description": "FastFood",
+                "iban": "DE91100000000123456789",
+            }
+            for day in range(19, 0, -2)
+        ],
+    }
+
+    def post(self, query):
+        return APIClient().post(f"/report/?{query}", self.request_body, format="json")
+
+    def test_limit_and_offset_select_page_of_chronological_report(self):
+        response = self.post("limit=3&offset=2")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["count"] == 20
+        assert [row["amount"] for row in body["results"]] == [3, 4, 5]
+        assert body["next"] == "http://testserver/report/?limit=3&offset=5"
+        assert body["previous"] == "http://testserver/report/?limit=3"
+
+    def test_cursor_walks_through_whole_report(self):
+        amounts, query = [], "limit=6&cursor="
+        while query is not None:
+            body = self.post(query).json()
+            amounts.extend(row["amount"] for row in body["results"])
+            query = body["next"] and body["next"].split("?", 1)[1]
+        assert amounts == list(range(1, 21))
+
+    @pytest.mark.parametrize(
+        "cursor", ["not-base64", '["2021-05-05T12:00:00", 1]', '["2021-05-05", "x"]']
+    )
+    def test_invalid_cursor_is_rejected(self, cursor):
+        if cursor.startswith("["):
+            cursor = base64.urlsafe_b64encode(cursor.encode()).decode()
+        response = self.post(f"limit=6&cursor={cursor}")
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Invalid cursor"}
+
+    def test_date_window_limits_report(self):
+        response = self.post("date_from=2021-05-05&date_to=2021-05-07T12:00:00Z")
+        assert response.status_code == 200
+        assert [row["amount"] for row in response.json()] == [5, 6, 7]
+
+    def test_invalid_date_window_is_rejected(self):
+        response = self.post("date_from=yesterday")
+        assert response.status_code == 400
+        assert response.json() == {
+            "date_from": ["Expected an ISO 8601 date or datetime."]
+        }
+
+    def test_rates_are_fetched_only_for_rows_on_page(self, monkeypatch_requests):
+        response = self.post("limit=1&offset=1")
+        assert response.json()["results"][0]["currency"] == "EUR"
+        assert len(monkeypatch_requests) == 1
+        assert "/eur/" in monkeypatch_requests[0]
+
 
 @pytest.mark.django_db
 class TestCustomerReport:
@@ -357,7 +492,7 @@ class TestCustomerReport:
         report = Report.objects.get(id=customer_id)
         get_response = client.get(f"/customer-report/{customer_id}/")
         assert (
-            report.report
+            ReportSerializer(report).data["report"]
             == get_response.json()
             == [
                 {
@@ -414,7 +549,7 @@ class TestCustomerReport:
         # Assert report is updated
         get_response = client.get(f"/customer-report/{customer_id}/")
         assert (
-            report.report
+            ReportSerializer(report).data["report"]
             == get_response.json()
             == [
                 {
@@ -428,3 +563,333 @@ class TestCustomerReport:
                 }
             ]
         )
+
+    def test_customer_report_updates_existing_report_from_streamed_body(self):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/?stream=1",
+            {
+                "pay_by_link": [
+                    {
+                        "created_at": "2021-05-13T01:01:43-08:00",
+                        "currency": "EUR",
+                        "amount": 3001,
+                        "description": "Abonament na siłownię",
+                        "bank": "mbank",
+                    }
+                ],
+            },
+            format="json",
+        ).json()["customer_id"]
+        # customer_id comes after the payments, it is known only once they are read
+        response = client.post(
+            "/customer-report/?stream=1",
+            {
+                "pay_by_link": [
+                    {
+                        "created_at": "2021-05-13T01:01:43-08:00",
+                        "currency": "EUR",
+                        "amount": 9999,
+                        "description": "Abonament na jogę",
+                        "bank": "pko",
+                    }
+                ],
+                "customer_id": customer_id,
+            },
+            format="json",
+        )
+        assert response.status_code == 201
+        assert response.json() == {"customer_id": customer_id}
+        assert client.get(f"/customer-report/{customer_id}/").json() == [
+            {
+                "date": "2021-05-13T09:01:43Z",
+                "type": "pay_by_link",
+                "amount": 9999,
+                "currency": "EUR",
+                "description": "Abonament na jogę",
+                "payment_mean": "pko",
+                "amount_in_pln": 9999 * EXCHANGE_RATE,
+            }
+        ]
+
+    def test_customer_report_rejects_malformed_streamed_body(self):
+        client = APIClient()
+        response = client.post(
+            "/customer-report/?stream=1",
+            '{"pay_by_link": [{"amount": 1}',
+            content_type="application/json",
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+class TestCustomerReportFiltering:
+    @pytest.fixture
+    def customer_id(self):
+        response = APIClient().post(
+            "/customer-report/",
+            {
+                "pay_by_link": [
+                    {
+                        "created_at": f"2021-05-{day:02}T12:00:00Z",
+                        "currency": "EUR",
+                        "amount": day,
+                        "description": "Abonament na siłownię",
+                        "bank": "mbank",
+                    }
+                    for day in range(1, 21, 2)
+                ],
+                "card": [
+                    {
+                        "created_at": f"2021-05-{day:02}T12:00:00Z",
+                        "currency": "PLN",
+                        "amount": day,
+                        "description": "REF123457",
+                        "cardholder_name": "John",
+                        "cardholder_surname": "Doe",
+                        "card_number": "341111111111111",
+                    }
+                    for day in range(2, 21, 2)
+                ],
+            },
+            format="json",
+        )
+        return response.json()["customer_id"]
+
+    def get(self, customer_id, query):
+        return APIClient().get(f"/customer-report/{customer_id}/?{query}")
+
+    def test_cursor_pagination_walks_through_report(self, customer_id):
+        amounts, url = [], f"/customer-report/{customer_id}/?page_size=7"
+        while url:
+            body = APIClient().get(url).json()
+            amounts.extend(row["amount"] for row in body["results"])
+            url = body["next"]
+        assert amounts == list(range(1, 21))
+
+    def test_filters_narrow_report_down(self, customer_id):
+        response = self.get(
+            customer_id, "type=card&date_from=2021-05-05&date_to=2021-05-10"
+        )
+        assert response.status_code == 200
+        assert [row["amount"] for row in response.json()] == [6, 8, 10]
+
+        response = self.get(customer_id, "currency=EUR&date_to=2021-05-05T11:00:00Z")
+        assert [row["amount"] for row in response.json()] == [1, 3]
+
+    def test_filters_and_pagination_combine(self, customer_id):
+        body = self.get(customer_id, "currency=PLN&page_size=2").json()
+        assert [row["amount"] for row in body["results"]] == [2, 4]
+        assert body["previous"] is None
+        assert body["next"] is not None
+
+
+@pytest.mark.django_db
+class TestCustomerReportAppend:
+    @staticmethod
+    def payment(day, amount):
+        return {
+            "created_at": f"2021-05-{day:02}T12:00:00Z",
+            "currency": "EUR",
+            "amount": amount,
+            "description": "Abonament na siłownię",
+            "bank": "mbank",
+        }
+
+    def test_append_merges_new_payments_into_existing_report(self):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/",
+            {"pay_by_link": [self.payment(1, 1), self.payment(3, 3)]},
+            format="json",
+        ).json()["customer_id"]
+
+        response = client.post(
+            "/customer-report/?append=1",
+            {
+                "customer_id": customer_id,
+                "pay_by_link": [
+                    self.payment(4, 4),
+                    self.payment(2, 2),
+                    self.payment(3, 5),
+                ],
+            },
+            format="json",
+        )
+
+        assert response.status_code == 201
+        assert response.json() == {"customer_id": customer_id}
+        report = client.get(f"/customer-report/{customer_id}/").json()
+        assert [row["amount"] for row in report] == [1, 2, 3, 5, 4]
+        assert Report.objects.get(id=customer_id).rows.count() == 5
+
+    def test_append_with_invalid_payment_leaves_report_untouched(self):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/",
+            {"pay_by_link": [self.payment(1, 1)]},
+            format="json",
+        ).json()["customer_id"]
+
+        response = client.post(
+            "/customer-report/?append=1",
+            {"customer_id": customer_id, "pay_by_link": [self.payment(2, -1)]},
+            format="json",
+        )
+
+        assert response.status_code == 400
+        assert Report.objects.get(id=customer_id).rows.count() == 1
+
+
+@pytest.mark.django_db
+class TestCustomerReportCaching:
+    request_body = {
+        "pay_by_link": [
+            {
+                "created_at": "2021-05-13T01:01:43-08:00",
+                "currency": "EUR",
+                "amount": 3001,
+                "description": "Abonament na siłownię",
+                "bank": "mbank",
+            }
+        ],
+    }
+
+    def test_conditional_get_returns_not_modified(self):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/", self.request_body, format="json"
+        ).json()["customer_id"]
+
+        response = client.get(f"/customer-report/{customer_id}/")
+        etag = response["ETag"]
+        assert response.status_code == 200
+
+        response = client.get(
+            f"/customer-report/{customer_id}/", HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+    def test_cached_report_reads_only_version(self, django_assert_num_queries):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/", self.request_body, format="json"
+        ).json()["customer_id"]
+        expected = client.get(f"/customer-report/{customer_id}/").json()
+
+        with django_assert_num_queries(2):
+            response = client.get(f"/customer-report/{customer_id}/")
+            assert response.json() == expected
+            etag = response["ETag"]
+            response = client.get(
+                f"/customer-report/{customer_id}/", HTTP_IF_NONE_MATCH=etag
+            )
+            assert response.status_code == 304
+
+    def test_update_invalidates_cached_report(self):
+        client = APIClient()
+        customer_id = client.post(
+            "/customer-report/", self.request_body, format="json"
+        ).json()["customer_id"]
+        etag = client.get(f"/customer-report/{customer_id}/")["ETag"]
+
+        client.post(
+            "/customer-report/?append=1",
+            {**self.request_body, "customer_id": customer_id},
+            format="json",
+        )
+
+        response = client.get(
+            f"/customer-report/{customer_id}/", HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        assert len(response.json()) == 2
+
+
+@pytest.mark.django_db
+class TestCustomerReportStorage:
+    request_body = TestCustomerReportCaching.request_body
+
+    @pytest.fixture(autouse=True)
+    def gzip_storage(self, settings):
+        settings.CUSTOMER_REPORT_STORAGE = "gzip"
+
+    def create_report(self, client):
+        return client.post(
+            "/customer-report/", self.request_body, format="json"
+        ).json()["customer_id"]
+
+    def test_report_is_stored_rendered(self):
+        client = APIClient()
+        customer_id = self.create_report(client)
+
+        report = Report.objects.get(id=customer_id)
+        assert report.rendered_encoding == "gzip"
+        assert json.loads(gzip.decompress(report.rendered)) == (
+            ReportSerializer(report).data["report"]
+        )
+
+    def test_compressed_report_is_passed_through(self):
+        client = APIClient()
+        customer_id = self.create_report(client)
+        plain = client.get(f"/customer-report/{customer_id}/")
+        cache.clear()
+
+        response = client.get(
+            f"/customer-report/{customer_id}/", HTTP_ACCEPT_ENCODING="gzip, br"
+        )
+        assert response["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response["Vary"]
+        assert json.loads(gzip.decompress(response.content)) == plain.json()
+
+    def test_report_is_decompressed_for_other_clients(self):
+        client = APIClient()
+        customer_id = self.create_report(client)
+
+        response = client.get(
+            f"/customer-report/{customer_id}/", HTTP_ACCEPT_ENCODING="gzip;q=0"
+        )
+        assert not response.has_header("Content-Encoding")
+        assert (
+            response.json()
+            == ReportSerializer(Report.objects.get(id=customer_id)).data["report"]
+        )
+
+    def test_append_renders_report_again(self):
+        client = APIClient()
+        customer_id = self.create_report(client)
+        client.post(
+            "/customer-report/?append=1",
+            {**self.request_body, "customer_id": customer_id},
+            format="json",
+        )
+        assert Report.objects.get(id=customer_id).rendered is None
+
+        response = client.get(f"/customer-report/{customer_id}/")
+        assert len(response.json()) == 2
+        assert Report.objects.get(id=customer_id).rendered is not None
+
+    def test_filtered_report_is_not_served_from_storage(self):
+        client = APIClient()
+        customer_id = self.create_report(client)
+
+        response = client.get(
+            f"/customer-report/{customer_id}/?currency=PLN",
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+        assert not response.has_header("Content-Encoding")
+        assert response.json() == []
+
+    @pytest.mark.parametrize(
+        "storage, error",
+        [("lz4", "reports.E001"), ("zstd", "reports.E002"), ("gzip", None)],
+    )
+    def test_storage_setting_is_checked(self, settings, monkeypatch, storage, error):
+        settings.CUSTOMER_REPORT_STORAGE = storage
+        monkeypatch.setattr(checks, "available", lambda encoding: encoding != "zstd")
+
+        errors = [e.id for e in run_checks() if e.id.startswith("reports.")]
+
+        assert errors == ([error] if error else [])